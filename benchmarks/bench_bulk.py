@@ -0,0 +1,46 @@
+# Compares one command per path with one command for every path, for touch, chmod and rm
+# on files in the same (deep) directory.
+# Usage: python3 benchmarks/bench_bulk.py [files]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import nautilus
+
+DIRECTORY = "/a/b/c/d/e/f/g/h"
+
+# Runs the lines through the same parse and dispatch as the shell, returning the seconds taken
+def timed(manager, commands: dict, lines: list) -> float:
+    start = time.perf_counter()
+    for line in lines:
+        nautilus.runLine(manager, commands, line)
+    return time.perf_counter() - start
+
+def discard(text: str):
+    pass
+
+def bench(files: int, bulk: bool):
+    commands = nautilus.COMMANDS
+    manager = nautilus.Manager(nautilus.newRoot())
+    # What the commands print is dropped
+    manager.out = manager.err = discard
+    timed(manager, commands, [f"mkdir -p {DIRECTORY}"])
+    paths = [f"{DIRECTORY}/file{i}" for i in range(files)]
+    results = []
+    for command in ["touch", "chmod o+w", "rm"]:
+        if bulk:
+            lines = [f"{command} " + " ".join(paths)]
+        else:
+            lines = [f"{command} {path}" for path in paths]
+        results.append(f"{command.split()[0]} {timed(manager, commands, lines):6.3f}s")
+    print(f"{'one command' if bulk else 'one per path':>12}: " + " | ".join(results))
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    print(f"{files} files in {DIRECTORY}")
+    bench(files, False)
+    bench(files, True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# Runs commands on one SharedManager from many threads at once. The first part has every thread
+# become its own user in its own home and touch files there and in a directory they all share,
+# while moving and chmodding others, then checks that no file went missing, every directory's
+# index still matches its contents and every thread kept its own user and working directory.
+# The second part times read-only commands (ls, pwd, cd, find) on 1, 2, 4 and 8 threads, with
+# and without a thread writing alongside them, and reports reads per second over all threads.
+# The last part times writes, and the longest any one of them took, while another thread runs
+# find over the whole tree again and again, against the same writes with nothing else running.
+# Usage: python3 benchmarks/bench_concurrency.py [threads] [files per thread]
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import nautilus
+
+def discard(text: str):
+    pass
+
+# Runs target(i) on count threads, started together, and returns the seconds they took
+def together(count: int, target) -> float:
+    barrier = threading.Barrier(count + 1)
+    def run(i: int):
+        barrier.wait()
+        target(i)
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+def newManager(threads: int) -> nautilus.SharedManager:
+    manager = nautilus.SharedManager(nautilus.newRoot())
+    manager.out = manager.err = discard
+    manager.mkdir("-p", "/shared")
+    manager.chmod("a+w", "/shared")
+    for i in range(threads):
+        manager.adduser(f"user{i}")
+        manager.mkdir("-p", f"/home/user{i}/old")
+        manager.chown("-r", f"user{i}", f"/home/user{i}")
+    return manager
+
+def stress(threads: int, files: int):
+    manager = newManager(threads)
+    wrong = []
+    def work(i: int):
+        manager.out = manager.err = discard
+        manager.su(f"user{i}")
+        manager.cd(f"/home/user{i}")
+        for j in range(files):
+            manager.touch(f"file{j}", f"/shared/user{i}-{j}")
+            if j % 2:
+                manager.mv(f"file{j - 1}", f"old/file{j - 1}")
+                manager.chmod("o-r", f"old/file{j - 1}")
+        result = manager.call("pwd")
+        if manager.user != f"user{i}" or result.lines != [f"/home/user{i}"]:
+            wrong.append(i)
+    elapsed = together(threads, work)
+
+    # Every file where it should be, with its owner, and no directory left out of order
+    missing = 0
+    for i in range(threads):
+        home = nautilus.checkPath(manager, f"/home/user{i}")
+        old = home.get("old")
+        for j in range(files):
+            node = (old if j % 2 == 0 and j + 1 < files else home).get(f"file{j}")
+            missing += node is None or manager.owner_name(node) != f"user{i}"
+            missing += nautilus.checkPath(manager, f"/shared/user{i}-{j}") is None
+    broken = 0
+    for directory in nautilus.walkFiles(manager, manager.root):
+        if isinstance(directory, nautilus.Directory):
+            names = [child.name for child in directory.contents]
+            broken += names != sorted(names) or len(directory.index) != len(set(names))
+    commands = threads * files * 3
+    print(f"stress: {threads} threads, {commands} changes in {elapsed:.2f}s ({commands / elapsed:.0f}/s):"
+          f" {missing} lost, {broken} directories out of order, {len(wrong)} threads with the wrong session")
+
+def reads(threads: int, count: int, writer: bool) -> float:
+    manager = newManager(threads)
+    for i in range(200):
+        manager.touch(f"/home/user0/file{i}")
+    stop = threading.Event()
+    def write():
+        j = 0
+        while not stop.is_set():
+            manager.touch(f"/shared/file{j}")
+            j += 1
+    def read(i: int):
+        manager.out = manager.err = discard
+        for j in range(count):
+            manager.ls("/home/user0")
+            manager.pwd()
+            manager.cd(f"/home/user{i}")
+            manager.find("/home", "-name", "file1*")
+    background = threading.Thread(target=write)
+    if writer:
+        background.start()
+    elapsed = together(threads, read)
+    stop.set()
+    if writer:
+        background.join()
+    return threads * count * 4 / elapsed
+
+# Writes per second and the slowest write in milliseconds, with a thread running find meanwhile
+# if finding
+def writesDuringFind(files: int, count: int, finding: bool) -> tuple:
+    manager = newManager(1)
+    for i in range(files // 100):
+        manager.mkdir(f"/shared/dir{i}")
+        for j in range(100):
+            manager.touch(f"/shared/dir{i}/file{j}")
+    stop = threading.Event()
+    finds = 0
+    def find():
+        nonlocal finds
+        manager.out = manager.err = discard
+        while not stop.is_set():
+            manager.find("/")
+            finds += 1
+    background = threading.Thread(target=find)
+    if finding:
+        background.start()
+        time.sleep(0.1)
+    slowest = 0
+    start = time.perf_counter()
+    for i in range(count):
+        before = time.perf_counter()
+        manager.touch(f"/shared/dir{i % 10}/new{i}")
+        manager.chmod("o-r", f"/shared/dir{i % 10}/file{i % 100}")
+        slowest = max(slowest, time.perf_counter() - before)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    if finding:
+        background.join()
+    return count * 2 / elapsed, slowest * 1000, finds
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    stress(threads, files)
+    for writer in (False, True):
+        base = None
+        for count in (1, 2, 4, 8):
+            rate = reads(count, 400, writer)
+            base = base or rate
+            print(f"reads on {count} threads{' with a writer' if writer else ''}: {rate:8.0f}/s ({rate / base:.2f}x)")
+    for finding in (False, True):
+        rate, slowest, finds = writesDuringFind(20000, 2000, finding)
+        print(f"writes{f' during {finds} finds of the tree' if finding else ''}: {rate:8.0f}/s, slowest {slowest:.1f}ms")
+
+if __name__ == "__main__":
+    main()
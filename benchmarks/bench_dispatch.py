@@ -0,0 +1,61 @@
+# Splits the time a script of everyday commands takes into reading the line (splitLine),
+# checking it against its command's syntax and running the command, per command name.
+# Usage: python3 benchmarks/bench_dispatch.py [lines]
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import nautilus
+
+def script(count: int) -> list:
+    lines = ["mkdir -p /home/alice/docs", "adduser alice", "chown -r alice /home/alice"]
+    for i in range(count):
+        path = f"/home/alice/docs/file{random.randrange(1000)}"
+        lines.append(random.choice([f"touch {path}", f"chmod u+x {path}", f"rm {path}", "pwd",
+                                    "cd /home/alice", "cd /", "ls -l /home/alice", f"mv {path} {path}.old",
+                                    "su alice", "su", "mkdir /x/y/z"]))
+    return lines
+
+def discard(text: str):
+    pass
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    random.seed(0)
+    lines = script(count)
+    manager = nautilus.Manager(nautilus.newRoot())
+    commands = nautilus.COMMANDS
+    # command name -> [lines, seconds reading, seconds checking, seconds running]
+    totals = {}
+    clock = time.perf_counter
+    # What the commands print is dropped
+    manager.out = manager.err = discard
+    for line in lines:
+        start = clock()
+        words = nautilus.splitLine(line)
+        read = clock()
+        name = words.pop(0)
+        syntax = commands[name]
+        command = nautilus.parseCommand(manager, name, syntax, words)
+        checked = clock()
+        if command is not None:
+            syntax.function(manager, command)
+        done = clock()
+        total = totals.setdefault(name, [0, 0.0, 0.0, 0.0])
+        total[0] += 1
+        total[1] += read - start
+        total[2] += checked - read
+        total[3] += done - checked
+
+    print(f"{'command':<8} {'lines':>7} {'split':>9} {'syntax':>9} {'run':>9}   (us per line)")
+    for name, (n, reading, checking, running) in sorted(totals.items()):
+        print(f"{name:<8} {n:>7} {reading / n * 1e6:9.2f} {checking / n * 1e6:9.2f} {running / n * 1e6:9.2f}")
+    n, reading, checking, running = [sum(column) for column in zip(*totals.values())]
+    whole = reading + checking + running
+    print(f"{'all':<8} {n:>7} {reading / n * 1e6:9.2f} {checking / n * 1e6:9.2f} {running / n * 1e6:9.2f}"
+          f"   split {reading / whole:.0%}, syntax {checking / whole:.0%}, run {running / whole:.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# Compares the object and columnar tree engines: memory held by the tree and the
+# throughput of ls, checkPath and chmod -r.
+# Usage: python3 benchmarks/bench_engines.py [directories] [files per directory]
+import os
+import sys
+import time
+import random
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import nautilus
+
+def build(manager, directories: int, files: int):
+    for i in range(directories):
+        directory = manager.create_dir(f"dir{i}", manager.root)
+        for j in range(files):
+            manager.create_file(f"file{j}", directory)
+
+# Runs fn repeatedly for about a second, returning calls per second
+def rate(fn) -> float:
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= 1:
+            return calls / elapsed
+
+def bench(engine: str, directories: int, files: int):
+    tracemalloc.start()
+    # The path cache is off so every checkPath walks the tree
+    manager = nautilus.Manager(nautilus.newRoot(engine), cache_size=0)
+    build(manager, directories, files)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    nodes = directories * (files + 1) + 1
+
+    lsRate = rate(lambda: manager.ls("-l", "/dir0"))
+    paths = [f"/dir{random.randrange(directories)}/file{random.randrange(files)}" for _ in range(1000)]
+    checkRate = 1000 * rate(lambda: [nautilus.checkPath(manager, path) for path in paths])
+    start = time.perf_counter()
+    manager.chmod("-r", "a+x", "/")
+    chmodTime = time.perf_counter() - start
+
+    print(f"{engine:>9}: {memory / 2**20:7.1f} MiB ({memory / nodes:3.0f} B/node)"
+          f" | ls -l of {files} entries {lsRate:8.1f}/s"
+          f" | checkPath {checkRate:10.0f}/s"
+          f" | chmod -r over {nodes} nodes {chmodTime:6.2f}s")
+
+def main():
+    directories = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 999
+    for engine in ["objects", "columnar"]:
+        bench(engine, directories, files)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# Times find over a large tree: a whole walk, a walk cut short by -maxdepth and a walk below a
+# directory the user can't list, along with how soon the first match is printed.
+# Usage: python3 benchmarks/bench_find.py [directories] [files per directory]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import nautilus
+
+# Counts the lines find gives out and notes when the first one came
+class Output:
+    def __init__(self):
+        self.lines = 0
+        self.first = None
+
+    def line(self, text: str):
+        if self.first is None:
+            self.first = time.perf_counter()
+        self.lines += 1
+
+def timed(manager, args: list) -> str:
+    # Taking each line as find gives it out, rather than the lists of Manager.call
+    output = Output()
+    manager.out = manager.err = output.line
+    start = time.perf_counter()
+    nautilus.runCommand(manager, nautilus.COMMANDS, ["find"] + args)
+    elapsed = time.perf_counter() - start
+    first = (output.first - start) * 1000 if output.first is not None else float("nan")
+    return f"{' '.join(args):<30} {elapsed:6.2f}s, {output.lines:>7} lines, first after {first:7.2f}ms"
+
+def main():
+    directories = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 999
+    manager = nautilus.Manager(nautilus.newRoot())
+    manager.add_user("alice")
+    top = manager.create_dir("top", manager.root)
+    for i in range(directories):
+        directory = manager.create_dir(f"dir{i}", top)
+        for j in range(files):
+            manager.create_file(f"file{j}.txt" if j % 100 else f"file{j}.log", directory)
+    print(f"{directories * (files + 1) + 2} nodes")
+    print(timed(manager, ["/top"]))
+    print(timed(manager, ["/top", "-name", "*.log"]))
+    print(timed(manager, ["/top", "-type", "d"]))
+    print(timed(manager, ["/top", "-maxdepth", "1"]))
+    # Only the directories themselves are reached when none of them can be listed
+    for i in range(directories):
+        manager.set_perms(top.get(f"dir{i}"), nautilus.encodePerms("drwx---"))
+    manager.set_user("alice")
+    print(timed(manager, ["/top", "-name", "*.log"]) + " (as alice, directories not listable)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+# Expands /logs/2026-* on a directory where half of the entries match, measuring the memory
+# allocated while the matches are read (flat, as they're produced one at a time), then times
+# rm /logs/2026-*, which removes each match as it's produced.
+# Usage: python3 benchmarks/bench_glob.py [entries]
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import nautilus
+
+def bench(entries: int):
+    manager = nautilus.Manager(nautilus.newRoot())
+    logs = manager.create_dir("logs", manager.root)
+    for i in range(entries // 2):
+        manager.create_file(f"2025-{i:07}", logs)
+        manager.create_file(f"2026-{i:07}", logs)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    matches = sum(1 for path in nautilus.expandWords(manager, ["/logs/2026-*"]))
+    expandTime = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    manager.rm("/logs/2026-*")
+    rmTime = time.perf_counter() - start
+
+    print(f"{entries:>8} entries: {matches} matches in {expandTime:5.2f}s,"
+          f" peak allocated {peak / 2**10:5.1f} KiB"
+          f" | rm /logs/2026-* {rmTime:6.2f}s, {len(logs.contents)} left")
+
+def main():
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    entries = 10000
+    while entries <= largest:
+        bench(entries)
+        entries *= 10
+
+if __name__ == "__main__":
+    main()
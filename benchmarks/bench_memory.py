@@ -0,0 +1,31 @@
+# Measures the memory held by a namespace of roughly a million nodes.
+# Usage: python3 benchmarks/bench_memory.py [directories] [files per directory]
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import nautilus
+
+def build(manager, directories: int, files: int):
+    for i in range(directories):
+        directory = manager.create_dir(f"dir{i}", manager.root)
+        for j in range(files):
+            manager.create_file(f"file{j}", directory)
+
+def main():
+    directories = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 999
+    tracemalloc.start()
+    start = time.perf_counter()
+    manager = nautilus.Manager(nautilus.Directory("/", None))
+    build(manager, directories, files)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    nodes = directories * (files + 1) + 1
+    print(f"{nodes} nodes built in {elapsed:.2f}s")
+    print(f"memory: {current / 2**20:.1f} MiB ({current / nodes:.0f} bytes per node), peak {peak / 2**20:.1f} MiB")
+
+if __name__ == "__main__":
+    main()
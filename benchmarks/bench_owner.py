@@ -0,0 +1,45 @@
+# Times the owner index on a large tree where one user owns a small part: building it (one walk,
+# the first time it's needed), then owned, find / -owner and deluser --reassign, which only look at
+# what that user owns, next to a find / -owner for someone else that has to walk the whole tree.
+# Usage: python3 benchmarks/bench_owner.py [directories] [files per directory]
+import gc
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import nautilus
+
+def timed(label: str, manager, words: list):
+    gc.collect()
+    start = time.perf_counter()
+    manager.call(*words)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed * 1000:9.2f}ms")
+
+def main():
+    directories = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 999
+    manager = nautilus.Manager(nautilus.newRoot())
+    manager.add_user("alice")
+    manager.add_user("bob")
+    alice = manager.intern("alice")
+    top = manager.create_dir("top", manager.root)
+    for i in range(directories):
+        directory = manager.create_dir(f"dir{i}", top)
+        for j in range(files):
+            file = manager.create_file(f"file{j}", directory)
+            if j == 0:
+                file.owner = alice
+    # Keeps collections of the tree that was just built out of the timings
+    gc.freeze()
+    print(f"{directories * (files + 1) + 2} nodes, {directories} owned by alice")
+    timed("owned alice (builds the index)", manager, ["owned", "alice"])
+    timed("owned alice", manager, ["owned", "alice"])
+    timed("find / -owner alice", manager, ["find", "/", "-owner", "alice"])
+    timed("find / -name file0 (whole walk)", manager, ["find", "/", "-name", "file0"])
+    timed("deluser --reassign bob alice", manager, ["deluser", "--reassign", "bob", "alice"])
+    timed("find / -owner bob", manager, ["find", "/", "-owner", "bob"])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# Times chmod -r and chown -r over growing trees to show the cost per node stays flat.
+# chmod runs as a non-root owner so every file goes through the ownership and ancestor checks.
+# Usage: python3 benchmarks/bench_recursive.py [largest tree size]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import nautilus
+
+# A tree of nodes entries under /top: directories of 1000 files, nested 10 deep
+def build(manager, nodes: int):
+    top = manager.create_dir("top", manager.root)
+    directory = top
+    made = 1
+    while made < nodes:
+        directory = manager.create_dir(f"dir{made}", directory if directory.path.count("/") < 10 else top)
+        made += 1
+        for j in range(min(999, nodes - made)):
+            manager.create_file(f"file{j}", directory)
+            made += 1
+    return top
+
+# Runs one command, returning the seconds it took
+def timed(manager, words: list) -> float:
+    start = time.perf_counter()
+    manager.call(*words)
+    return time.perf_counter() - start
+
+def bench(nodes: int):
+    manager = nautilus.Manager(nautilus.newRoot())
+    manager.add_user("alice")
+    build(manager, nodes)
+    chownTime = timed(manager, ["chown", "-r", "alice", "/top"])
+    manager.set_user("alice")
+    chmodTime = timed(manager, ["chmod", "-r", "a+x", "/top"])
+    print(f"{nodes:>8} nodes"
+          f" | chown -r {chownTime:6.2f}s ({chownTime / nodes * 1e6:4.2f} us/node)"
+          f" | chmod -r {chmodTime:6.2f}s ({chmodTime / nodes * 1e6:4.2f} us/node)")
+
+def main():
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    nodes = 10000
+    while nodes <= largest:
+        bench(nodes)
+        nodes *= 10
+
+if __name__ == "__main__":
+    main()
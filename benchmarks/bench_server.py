@@ -0,0 +1,68 @@
+# Runs the server in-process on a Unix socket with many clients at once. Each client becomes its
+# own user, moves into its own home directory and touches files there with relative paths, so
+# any mix-up of users or working directories between sessions shows up as files in the wrong
+# place or with the wrong owner. Reports the lines per second the server handled overall.
+# Usage: python3 benchmarks/bench_server.py [clients] [lines per client]
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import nautilus
+
+PROMPT_END = b"$ "
+
+async def client(path: str, i: int, lines: int):
+    reader, writer = await asyncio.open_unix_connection(path, limit=1 << 24)
+    await reader.readuntil(PROMPT_END)
+    # Sends a line and returns what came back before the next prompt
+    async def send(line: str) -> bytes:
+        writer.write(line.encode() + b"\n")
+        await writer.drain()
+        return await reader.readuntil(PROMPT_END)
+    await send(f"su user{i}")
+    await send(f"cd /home/user{i}")
+    for j in range(lines):
+        await send(f"touch file{j}")
+    answer = await send("pwd")
+    writer.write(b"exit\n")
+    await writer.drain()
+    await reader.read()
+    writer.close()
+    return answer.decode().splitlines()[0]
+
+async def bench(clients: int, lines: int):
+    manager = nautilus.Manager(nautilus.newRoot())
+    manager.mkdir("/home")
+    for i in range(clients):
+        manager.adduser(f"user{i}")
+        manager.mkdir(f"/home/user{i}")
+        manager.chown(f"user{i}", f"/home/user{i}")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "nautilus.sock")
+        server = asyncio.create_task(nautilus.serve(manager, nautilus.COMMANDS, path))
+        while not os.path.exists(path):
+            await asyncio.sleep(0.01)
+        start = time.perf_counter()
+        answers = await asyncio.gather(*(client(path, i, lines) for i in range(clients)))
+        elapsed = time.perf_counter() - start
+        server.cancel()
+
+    wrong = sum(answer != f"/home/user{i}" for i, answer in enumerate(answers))
+    for i in range(clients):
+        home = nautilus.checkPath(manager, f"/home/user{i}")
+        files = list(home.contents)
+        wrong += len(files) != lines or any(manager.owner_name(file) != f"user{i}" for file in files)
+    total = clients * (lines + 4)
+    print(f"{clients:>4} clients x {lines} lines: {elapsed:6.2f}s, {total / elapsed:8.0f} lines/s,"
+          f" {wrong} sessions with the wrong working directory, user or files")
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    lines = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    asyncio.run(bench(clients, lines))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# Compares shlex.split with splitLine, which only falls back to shlex for lines with quotes or
+# escapes, over the lines of e2e_tests/*.in and over a synthetic script where 1 line in 100 is
+# quoted. The synthetic lines come from a pool of 100000, reused until there are enough. e2e lines
+# shlex can't split (a quote that isn't closed) are left out and counted.
+# Usage: python3 benchmarks/bench_tokenize.py [synthetic lines]
+import glob
+import itertools
+import os
+import random
+import shlex
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import nautilus
+
+def synthetic(count: int) -> list:
+    random.seed(0)
+    lines = []
+    for i in range(count):
+        path = f"/home/user{random.randrange(100)}/docs/file{random.randrange(10000)}.txt"
+        if random.random() < 0.01:
+            lines.append(f'touch "/home/user{random.randrange(100)}/my docs/file {i}.txt"')
+        else:
+            lines.append(random.choice([f"touch {path}", f"chmod -r u+x {path}", f"rm {path}",
+                                        f"ls -l {path}", f"mv {path} {path}.old", "pwd", "su alice"]))
+    return lines
+
+# Seconds split takes over the first count lines, cycling through lines as needed
+def timed(split, lines: list, count: int) -> float:
+    start = time.perf_counter()
+    for line in itertools.islice(itertools.cycle(lines), count):
+        split(line)
+    return time.perf_counter() - start
+
+def compare(label: str, lines: list, count: int):
+    before = timed(shlex.split, lines, count)
+    after = timed(nautilus.splitLine, lines, count)
+    print(f"{label:<28} {count:>9} lines: shlex.split {before:7.2f}s ({count / before:9.0f}/s)"
+          f" | splitLine {after:6.2f}s ({count / after:9.0f}/s) | {before / after:5.1f}x")
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000000
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "e2e_tests")
+    e2e = []
+    unsplittable = 0
+    for name in sorted(glob.glob(os.path.join(root, "*.in"))):
+        with open(name) as script:
+            for line in script.read().splitlines():
+                try:
+                    shlex.split(line)
+                except ValueError:
+                    unsplittable += 1
+                    continue
+                e2e.append(line)
+    print(f"{unsplittable} e2e lines left out that shlex can't split")
+    # Every e2e line 100 times over, so the timings are long enough to read
+    compare("e2e_tests/*.in (x100)", e2e, len(e2e) * 100)
+    compare("synthetic, 1% quoted", synthetic(min(count, 100000)), count)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+# Times provisioning many users through adduser, then su and deluser for every one of them, so
+# each step should take about the same time however many users already exist.
+# Usage: python3 benchmarks/bench_users.py [largest user count]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import nautilus
+
+def bench(count: int):
+    manager = nautilus.Manager(nautilus.newRoot())
+    names = [f"user{i}" for i in range(count)]
+    timings = []
+    for command in ("adduser", "su", "deluser"):
+        start = time.perf_counter()
+        for name in names:
+            if command == "deluser":
+                manager.set_user("root")
+            nautilus.runCommand(manager, nautilus.COMMANDS, [command, name])
+        timings.append((time.perf_counter() - start) / count * 1e6)
+    print(f"{count:>8} users: adduser {timings[0]:5.2f} us, su {timings[1]:5.2f} us,"
+          f" deluser {timings[2]:5.2f} us per user")
+
+def main():
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    count = 1000
+    while count <= largest:
+        bench(count)
+        count *= 10
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# Times undo-log snapshot and rollback on a large tree next to saving it to a file and loading it
+# back, the other way to get back to an earlier namespace, then a provisioning transaction that's
+# rolled back. Taking a snapshot or starting a transaction copies nothing and rolling back undoes
+# only the changes made since, so both should stay flat as the tree grows while save and load
+# grow with it.
+# Usage: python3 benchmarks/bench_versions.py [directories] [files per directory]
+import gc
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import nautilus
+
+def timed(label: str, function, *words):
+    gc.collect()
+    start = time.perf_counter()
+    result = function(*words)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<44} {elapsed * 1000:10.2f}ms")
+    assert not result.errors, result.errors
+
+def main():
+    directories = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 999
+    manager = nautilus.Manager(nautilus.newRoot())
+    top = manager.create_dir("top", manager.root)
+    for i in range(directories):
+        directory = manager.create_dir(f"dir{i}", top)
+        for j in range(files):
+            manager.create_file(f"file{j}", directory)
+    # Keeps collections of the tree that was just built out of the timings
+    gc.freeze()
+    print(f"{directories * (files + 1) + 2} nodes")
+    with tempfile.TemporaryDirectory() as temp:
+        path = os.path.join(temp, "namespace.snap")
+        timed("save", manager.save, path)
+        timed("load", manager.load, path)
+    timed("snapshot", manager.snapshot, "before")
+    for changes in (1, 100, 10000):
+        for i in range(changes):
+            manager.create_file(f"new{i}", top)
+        timed(f"rollback after {changes} new files", manager.rollback, "before")
+    timed("chmod -r o-r /top/dir0", manager.chmod, "-r", "o-r", "/top/dir0")
+    timed(f"rollback after chmod -r ({files + 1} changes)", manager.rollback, "before")
+    timed("snapshot -d", manager.snapshot, "-d", "before")
+
+    manager.adduser("alice")
+    timed("begin", manager.begin)
+    start = time.perf_counter()
+    for i in range(100):
+        manager.mkdir("-p", f"/home/alice/project{i}/src")
+        manager.touch(f"/home/alice/project{i}/src/main.py")
+    manager.chown("-r", "alice", "/home/alice")
+    manager.chmod("-r", "o-rwx", "/home/alice")
+    elapsed = time.perf_counter() - start
+    label = f"provisioning, {len(manager.undo_log)} changes"
+    print(f"{label:<44} {elapsed * 1000:10.2f}ms")
+    timed("rollback (the transaction)", manager.rollback)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+# Checks that --journal brings the namespace back after a crash. Each case runs nautilus.py with a
+# journal in a temporary directory, kills it or damages the journal the way a crash would, starts
+# it again and compares the namespace it comes back with (written out with save and read back
+# here) against the one the same commands give without a journal:
+#   replay      every record is replayed on restart
+#   torn        a last record cut short, or followed by a partial one, is cut off
+#   kill        SIGKILL in the middle of a script keeps exactly the commands logged before it
+#   compaction  records written after the journal was folded into its snapshot are replayed on it
+#   generation  a journal newer than its snapshot is refused, an older one is emptied
+#   transaction a transaction left open by SIGKILL is rolled back on restart, and stays rolled back
+# Prints one line per case and exits with status 1 if any of them failed.
+# Usage: python3 e2e_tests/check_journal.py
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+NAUTILUS = os.path.join(HERE, "..", "nautilus.py")
+sys.path.insert(0, os.path.join(HERE, ".."))
+import nautilus
+
+# Only journaled commands run by root with absolute paths, so line i of the script is record i
+SCRIPT = ["adduser alice", "adduser bob", "mkdir -p /home/alice/src /home/bob /srv"]
+for i in range(40):
+    SCRIPT += [f"touch /home/alice/src/file{i}.py", f"chmod o-r /home/alice/src/file{i}.py"]
+SCRIPT += ["chown -r alice /home/alice", "chown bob /home/bob", "chmod o-rwx /home/alice",
+           "cp /home/alice/src/file0.py /srv/main.py", "mv /home/alice/src/file1.py /home/bob/file1.py",
+           "rm /home/alice/src/file2*", "mkdir /tmp", "rmdir /tmp", "deluser bob"]
+
+def run(lines: list, *options: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, NAUTILUS, *options, "--batch", "-"], input="\n".join(lines) + "\n",
+                          capture_output=True, text=True)
+
+# Users, and every path with its owner and permissions, in a saved namespace
+def state(snapshot: str) -> tuple:
+    manager = nautilus.Manager(nautilus.newRoot())
+    nautilus.loadSnapshot(manager, snapshot)
+    nodes = [(path, manager.owner_name(node), node.perms) for node, path, _ in nautilus.walkPaths(manager, manager.root, "/")]
+    return list(manager.users), nodes
+
+# The namespace the given commands make without a journal
+def expected(temp: str, lines: list) -> tuple:
+    path = os.path.join(temp, "expected.snap")
+    run(lines + [f"save {path}"])
+    return state(path)
+
+# The namespace nautilus.py comes back with when started on the journal, None if it refused to start
+def restarted(journal: str, *options: str) -> tuple:
+    path = journal + ".state"
+    if run([f"save {path}"], "--journal", journal, *options).returncode != 0:
+        return None
+    return state(path)
+
+# Where each intact record of a journal ends
+def recordEnds(journal: str) -> list:
+    with open(journal, "rb") as file:
+        data = file.read()
+    ends = []
+    offset = nautilus.JOURNAL_HEADER.size
+    while offset + nautilus.JOURNAL_RECORD.size <= len(data):
+        length, _ = nautilus.JOURNAL_RECORD.unpack_from(data, offset)
+        if offset + nautilus.JOURNAL_RECORD.size + length > len(data):
+            break
+        offset += nautilus.JOURNAL_RECORD.size + length
+        ends.append(offset)
+    return ends
+
+def replay(temp: str) -> bool:
+    journal = os.path.join(temp, "journal")
+    run(SCRIPT, "--journal", journal)
+    return len(recordEnds(journal)) == len(SCRIPT) and restarted(journal) == expected(temp, SCRIPT)
+
+def torn(temp: str) -> bool:
+    journal = os.path.join(temp, "journal")
+    run(SCRIPT, "--journal", journal)
+    ends = recordEnds(journal)
+    good = True
+    # Cut inside the last record's header and inside its payload: it's dropped
+    for cut in (ends[-2] + 2, ends[-1] - 3):
+        with open(journal, "r+b") as file:
+            file.truncate(cut)
+        good &= restarted(journal) == expected(temp, SCRIPT[:-1]) and os.path.getsize(journal) == ends[-2]
+        run(SCRIPT[-1:], "--journal", journal)
+    # Half of a record after the last whole one: it's dropped and the rest kept
+    with open(journal, "ab") as file:
+        file.write(nautilus.JOURNAL_RECORD.pack(100, 0) + b"root\0/\0touch\0/ha")
+    good &= restarted(journal) == expected(temp, SCRIPT) and os.path.getsize(journal) == ends[-1]
+    return good
+
+def kill(temp: str) -> bool:
+    journal = os.path.join(temp, "journal")
+    lines = ["mkdir /k"] + [f"touch /k/file{i}" for i in range(100000)]
+    script = os.path.join(temp, "script")
+    with open(script, "w") as file:
+        file.write("\n".join(lines) + "\n")
+    process = subprocess.Popen([sys.executable, NAUTILUS, "--journal", journal, "--batch", script],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    while process.poll() is None and (not os.path.exists(journal) or os.path.getsize(journal) < 20000):
+        time.sleep(0.001)
+    process.send_signal(signal.SIGKILL)
+    process.wait()
+    logged = len(recordEnds(journal))
+    # Twice, as the first restart may have cut off a torn record
+    first, second = restarted(journal), restarted(journal)
+    names = [path for path, _, _ in first[1]]
+    return 1 < logged < len(lines) and first == second and names == ["/", "/k"] + sorted(
+        f"/k/file{i}" for i in range(logged - 1))
+
+def compaction(temp: str) -> bool:
+    journal = os.path.join(temp, "journal")
+    run(SCRIPT, "--journal", journal, "--compact-size", "1000")
+    records = len(recordEnds(journal))
+    return (os.path.exists(journal + ".snap") and 0 < records < len(SCRIPT)
+            and restarted(journal) == expected(temp, SCRIPT))
+
+def generation(temp: str) -> bool:
+    journal = os.path.join(temp, "journal")
+    run(SCRIPT, "--journal", journal, "--compact-size", "1000")
+    with open(journal, "rb") as file:
+        magic, version, current = nautilus.JOURNAL_HEADER.unpack(file.read(nautilus.JOURNAL_HEADER.size))
+    # A compaction that saved the snapshot but didn't get to reset the journal: the journal's
+    # records are already in the snapshot, so they're dropped rather than replayed again
+    with open(journal, "r+b") as file:
+        file.write(nautilus.JOURNAL_HEADER.pack(magic, version, current - 1))
+    older = restarted(journal) == state(journal + ".snap") and os.path.getsize(journal) == nautilus.JOURNAL_HEADER.size
+    # A snapshot from before the journal started: nothing can be replayed on it
+    run(SCRIPT, "--journal", journal, "--compact-size", "1000")
+    run([f"save {journal}.snap"])
+    result = run([], "--journal", journal)
+    newer = result.returncode == 2 and "Journal is newer than its snapshot" in result.stderr
+    return current > 0 and older and newer
+
+def transaction(temp: str) -> bool:
+    journal = os.path.join(temp, "journal")
+    run(SCRIPT, "--journal", journal)
+    process = subprocess.Popen([sys.executable, NAUTILUS, "--journal", journal], stdin=subprocess.PIPE,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, text=True)
+    opened = ["begin", "mkdir /tx", "touch /tx/a", "chmod -r o+w /home", "deluser alice"]
+    process.stdin.write("\n".join(opened) + "\n")
+    process.stdin.flush()
+    while len(recordEnds(journal)) < len(SCRIPT) + len(opened):
+        time.sleep(0.001)
+    process.send_signal(signal.SIGKILL)
+    process.wait()
+    process.stdin.close()
+    before = expected(temp, SCRIPT)
+    return restarted(journal) == before and restarted(journal) == before
+
+CASES = [replay, torn, kill, compaction, generation, transaction]
+
+def main():
+    failed = 0
+    for case in CASES:
+        with tempfile.TemporaryDirectory() as temp:
+            good = case(temp)
+        failed += not good
+        print(f"{case.__name__:<12} {'ok' if good else 'FAILED'}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
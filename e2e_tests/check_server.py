@@ -0,0 +1,210 @@
+# Checks that sessions sharing one namespace keep to themselves what they should and see each
+# other's changes. The server cases run it in-process on a Unix socket and talk to it as clients
+# would; the last case uses a SharedManager from several threads:
+#   sessions     each connection keeps its own user and working directory
+#   shared       a change made in one connection is seen by the others straight away
+#   host         save and load are refused, and leave the host's files and the namespace alone
+#   cwd          rmdir refuses another connection's working directory, and rollback sends a
+#                connection whose working directory it took away back to /
+#   disconnect   a transaction left open by a connection that closes is rolled back
+#   threads      SharedManager threads keep their own user and working directory, and see each
+#                other's files
+#   versions     writers don't wait for a find that's still going, which goes on listing the tree
+#                as it was when it started, and neither does one started in an open transaction
+# Prints one line per case and exits with status 1 if any of them failed.
+# Usage: python3 e2e_tests/check_server.py
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+import nautilus
+
+PROMPT_END = b"$ "
+
+# A connection to the server: send returns the lines a command printed and the prompt after them
+class Client:
+    async def open(self, path: str):
+        self.reader, self.writer = await asyncio.open_unix_connection(path)
+        self.prompt = (await self.reader.readuntil(PROMPT_END)).decode()
+        return self
+
+    async def send(self, line: str) -> list:
+        self.writer.write(line.encode() + b"\n")
+        await self.writer.drain()
+        *lines, self.prompt = (await self.reader.readuntil(PROMPT_END)).decode().split("\n")
+        return lines
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+# Runs case with a fresh server and a function opening clients to it
+async def withServer(case, temp: str) -> bool:
+    manager = nautilus.Manager(nautilus.newRoot())
+    path = os.path.join(temp, "nautilus.sock")
+    server = asyncio.create_task(nautilus.serve(manager, nautilus.COMMANDS, path))
+    while not os.path.exists(path):
+        await asyncio.sleep(0.01)
+    try:
+        return await case(lambda: Client().open(path), temp)
+    finally:
+        server.cancel()
+
+async def sessions(connect, temp: str) -> bool:
+    a, b = await connect(), await connect()
+    for line in ["adduser alice", "mkdir -p /home/alice", "chown alice /home/alice", "cd /home/alice", "su alice"]:
+        await a.send(line)
+    good = await b.send("pwd") == ["/"] and b.prompt == "root:/$ "
+    good &= await a.send("pwd") == ["/home/alice"] and a.prompt == "alice:/home/alice$ "
+    await b.send("cd /home")
+    good &= await a.send("pwd") == ["/home/alice"] and await b.send("pwd") == ["/home"]
+    await a.close(), await b.close()
+    return good
+
+async def shared(connect, temp: str) -> bool:
+    a, b = await connect(), await connect()
+    await a.send("mkdir /srv")
+    await a.send("touch /srv/app.conf")
+    good = await b.send("ls -l /srv") == ["-rw-r-- root app.conf"]
+    await b.send("rm /srv/app.conf")
+    good &= await a.send("ls /srv") == []
+    await a.close(), await b.close()
+    return good
+
+async def host(connect, temp: str) -> bool:
+    a = await connect()
+    snapshot = os.path.join(temp, "host.snap")
+    await a.send("mkdir /kept")
+    good = await a.send(f"save {snapshot}") == ["save: Operation not permitted"] and not os.path.exists(snapshot)
+    good &= await a.send(f"load {os.path.join(HERE, 'columnar.snap')}") == ["load: Operation not permitted"]
+    good &= await a.send("ls /") == ["kept"]
+    await a.close()
+    return good
+
+async def cwd(connect, temp: str) -> bool:
+    a, b = await connect(), await connect()
+    await b.send("mkdir /work")
+    await b.send("cd /work")
+    good = await a.send("rmdir /work") == ["rmdir: Cannot remove pwd"]
+    await b.send("cd /")
+    for line in ["begin", "mkdir /tx", "cd /tx"]:
+        await a.send(line)
+    good &= a.prompt == "root:/tx$ "
+    await a.send("rollback")
+    good &= a.prompt == "root:/$ " and await a.send("ls /") == ["work"]
+    await a.close(), await b.close()
+    return good
+
+async def disconnect(connect, temp: str) -> bool:
+    a, b = await connect(), await connect()
+    await a.send("begin")
+    await a.send("mkdir /gone")
+    await a.close()
+    good = await b.send("ls /") == []
+    await b.close()
+    return good
+
+def threads(temp: str) -> bool:
+    count, files = 8, 50
+    manager = nautilus.SharedManager(nautilus.newRoot())
+    for i in range(count):
+        manager.adduser(f"user{i}")
+        manager.mkdir("-p", f"/home/user{i}")
+        manager.chown(f"user{i}", f"/home/user{i}")
+    barrier = threading.Barrier(count)
+    answers = [None] * count
+    def work(i: int):
+        manager.cd(f"/home/user{i}")
+        manager.su(f"user{i}")
+        for j in range(files):
+            manager.touch(f"file{j}")
+        barrier.wait()
+        # Everyone's files are there by now, and this thread is still where it was
+        seen = manager.ls(f"/home/user{(i + 1) % count}").lines
+        answers[i] = (manager.pwd().lines, manager.user, len(seen))
+    workers = [threading.Thread(target=work, args=(i,)) for i in range(count)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    good = answers == [([f"/home/user{i}"], f"user{i}", files) for i in range(count)]
+    # The main thread never moved
+    good &= manager.pwd().lines == ["/"] and manager.user == "root"
+    for i in range(count):
+        home = nautilus.checkPath(manager, f"/home/user{i}")
+        good &= all(manager.owner_name(node) == f"user{i}" for node in home.contents)
+    return good
+
+# Runs a command in a thread of its own, as the thread's root, and returns the thread
+def runThread(manager, line: str, out=None) -> threading.Thread:
+    def run():
+        if out is not None:
+            manager.out = out
+        nautilus.runLine(manager, nautilus.COMMANDS, line)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+def versions(temp: str) -> bool:
+    manager = nautilus.SharedManager(nautilus.newRoot())
+    manager.adduser("alice")
+    for i in range(20):
+        manager.mkdir("-p", f"/data/dir{i}")
+        manager.touch(f"/data/dir{i}/file")
+    manager.chown("-r", "alice", "/data/dir1")
+    before = manager.find("/").lines
+    # A find that stops after its first line until the writers are done
+    started, resume = threading.Event(), threading.Event()
+    lines = []
+    def out(line: str):
+        lines.append(line)
+        started.set()
+        resume.wait()
+    reader = runThread(manager, "find /", out)
+    started.wait()
+    writes = ["chmod -r o-r /data", "touch /data/new", "rm /data/dir2/file", "mv /data/dir3/file /file",
+              "rmdir /data/dir4", "chown -r root /data/dir1", "deluser alice"]
+    writer = threading.Thread(target=lambda: [manager.call(*line.split()) for line in writes])
+    writer.start()
+    writer.join(10)
+    good = not writer.is_alive() and manager.owned("alice").errors == ["owned: Invalid user"]
+    resume.set()
+    reader.join()
+    good &= lines == before and manager.find("/").lines != before
+    # A transaction still open in one thread doesn't hold up reads in another, which don't see it
+    opened = threading.Event()
+    def transaction():
+        for line in ["begin", "mkdir /tx", "touch /tx/a"]:
+            manager.call(*line.split())
+        opened.set()
+        resume.wait()
+        manager.rollback()
+    resume.clear()
+    holder = threading.Thread(target=transaction)
+    holder.start()
+    opened.wait()
+    lines = []
+    reader = runThread(manager, "ls /", lines.append)
+    reader.join(10)
+    good &= not reader.is_alive() and lines == ["data", "file"]
+    resume.set()
+    holder.join()
+    return good
+
+SERVER_CASES = [sessions, shared, host, cwd, disconnect]
+
+def main():
+    failed = 0
+    for case in SERVER_CASES + [threads, versions]:
+        with tempfile.TemporaryDirectory() as temp:
+            good = case(temp) if case in (threads, versions) else asyncio.run(withServer(case, temp))
+        failed += not good
+        print(f"{case.__name__:<12} {'ok' if good else 'FAILED'}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,72 +1,790 @@
 import sys
+import time
 import shlex
+import struct
+import zlib
+import os
+import argparse
+import asyncio
+import re
+import traceback
+import threading
+import weakref
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, namedtuple
+from enum import Enum
+from functools import lru_cache
+from fnmatch import fnmatchcase
+import itertools
+
+## PERMISSIONS
+#
+# Permissions are stored as a bitmask: a bit for directories above "rwx" for the owner
+# and "rwx" for other users ("drwxr-x" -> 0b1111101).
+
+DIRECTORY_BIT = 0x40
+# Bits tested by checkPerm, shifted up by 3 for the owner
+PERM_BITS = {"r": 0x4, "w": 0x2, "x": 0x1}
+# The root user always has id 0, see Manager.intern
+ROOT_ID = 0
+
+def encodePerms(perms: str) -> int:
+    bits = DIRECTORY_BIT if perms[0] == "d" else 0
+    for i in range(6):
+        if perms[i + 1] != "-":
+            bits |= 0x20 >> i
+    return bits
+
+def decodePerms(bits: int) -> str:
+    perms = "d" if bits & DIRECTORY_BIT else "-"
+    for i in range(6):
+        perms += "rwxrwx"[i] if bits & (0x20 >> i) else "-"
+    return perms
+
+# Every possible permission string, indexed by its encoding
+PERMS_STRINGS = [decodePerms(bits) for bits in range(128)]
+FILE_PERMS = encodePerms("-rw-r--")
+DIRECTORY_PERMS = encodePerms("drwxr-x")
+
+# Bits a chmod mode can name: "u" is the owner's three, "o" the other users' and "a" both
+MODE_WHO = {"u": 0x38, "o": 0x07, "a": 0x3f}
+MODE_BITS = {"r": 0x24, "w": 0x12, "x": 0x09}
+
+# A chmod mode such as "ua+rx", compiled to the bits it covers (mask), the operator and
+# the bits it names within the mask
+class Mode(namedtuple("Mode", ["mask", "op", "bits"])):
+    __slots__ = ()
+
+    def apply(self, perms: int) -> int:
+        if self.op == "+":
+            return perms | self.bits
+        elif self.op == "-":
+            return perms & ~self.bits
+        return perms & ~self.mask | self.bits
+
+# Returns the compiled mode, or None if the mode is invalid. Scripts tend to repeat the same
+# few modes, so they're only parsed once.
+@lru_cache(maxsize=256)
+def compileMode(mode: str) -> Mode:
+    # Exactly one operator, with only "u", "o" or "a" before it and "r", "w" or "x" after it
+    if mode.count("-") + mode.count("+") + mode.count("=") != 1:
+        return None
+    op = "-" if "-" in mode else "+" if "+" in mode else "="
+    who, bits = mode.split(op)
+    mask = 0
+    for char in who:
+        if char not in MODE_WHO:
+            return None
+        mask |= MODE_WHO[char]
+    named = 0
+    for char in bits:
+        if char not in MODE_BITS:
+            return None
+        named |= MODE_BITS[char]
+    return Mode(mask, op, named & mask)
+
+# Children of a directory sorted by name, split into blocks of up to 2 * BLOCK_SIZE so adding or
+# removing one only shifts what comes after it in its own block. The blocks are lists of nodes for
+# the object engine and arrays of rows for the columnar one, key gives the name of either.
+# Once the blocks are shared with a version of the tree (see share), neither the list of them nor
+# any block in it changes again: a block is copied the first time it has to change.
+BLOCK_SIZE = 512
+
+class SortedBlocks():
+    __slots__ = ("blocks", "size", "key", "empty", "owned")
+    # the blocks in order, none of them empty
+    blocks: list
+    # number of children over every block
+    size: int
+    # ids of the blocks made since the blocks were last shared, which can be changed in place.
+    # None if they never were, when every block can
+    owned: set
+    def __init__(self, key, empty, blocks: list = None):
+        self.blocks = [] if blocks is None else blocks
+        self.size = sum(map(len, self.blocks))
+        self.key = key
+        # makes an empty block
+        self.empty = empty
+        self.owned = None
+
+    # The blocks as they are now, for a version of the tree to keep. The list is copied here and
+    # the blocks as they come to change (see own)
+    def share(self) -> list:
+        blocks = self.blocks
+        self.blocks = list(blocks)
+        self.owned = set()
+        return blocks
+
+    # Block k, to be changed in place
+    def own(self, k: int):
+        block = self.blocks[k]
+        owned = self.owned
+        if owned is not None and id(block) not in owned:
+            block = self.blocks[k] = block[:]
+            owned.add(id(block))
+        return block
+
+    # Puts new blocks in place of blocks[k : k + 1]
+    def split(self, k: int, blocks: list):
+        self.blocks[k : k + 1] = blocks
+        if self.owned is not None:
+            self.owned.update(map(id, blocks))
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self.blocks)
+
+    def __reversed__(self):
+        return itertools.chain.from_iterable(map(reversed, reversed(self.blocks)))
+
+    def last_name(self, block) -> str:
+        return self.key(block[-1])
+
+    # Block and place in it of the first child named after the given name (the block count if none is)
+    def after(self, name: str) -> tuple:
+        blocks = self.blocks
+        k = bisect_right(blocks, name, key=self.last_name)
+        if k == len(blocks):
+            return k, 0
+        return k, bisect_right(blocks[k], name, key=self.key)
+
+    # Adds a child after any others with the same name
+    def add(self, child):
+        blocks = self.blocks
+        self.size += 1
+        if not blocks:
+            block = self.empty()
+            block.append(child)
+            self.split(0, [block])
+            return
+        k, i = self.after(self.key(child))
+        if k == len(blocks):
+            k -= 1
+            i = len(blocks[k])
+        block = self.own(k)
+        block.insert(i, child)
+        if len(block) > 2 * BLOCK_SIZE:
+            self.split(k, [block[:BLOCK_SIZE], block[BLOCK_SIZE:]])
+
+    def remove(self, child):
+        blocks = self.blocks
+        name = self.key(child)
+        k = bisect_left(blocks, name, key=self.last_name)
+        i = bisect_left(blocks[k], name, key=self.key)
+        # Past any others with the same name, which can run on into the next blocks
+        while blocks[k][i] != child:
+            i += 1
+            if i == len(blocks[k]):
+                k += 1
+                i = 0
+        block = self.own(k)
+        del block[i]
+        self.size -= 1
+        if not block:
+            del blocks[k]
+
+    # The last child with the given name, None if there's none
+    def last(self, name: str):
+        blocks = self.blocks
+        k, i = self.after(name)
+        if i == 0:
+            if k == 0:
+                return None
+            k -= 1
+            i = len(blocks[k])
+        child = blocks[k][i - 1]
+        return child if self.key(child) == name else None
+
+    # Children whose names start with prefix, in order. Every step bisects again past the last
+    # name given out, so children can be added or removed while it's being used.
+    def scan(self, prefix: str = ""):
+        blocks = self.blocks
+        k = bisect_left(blocks, prefix, key=self.last_name)
+        i = bisect_left(blocks[k], prefix, key=self.key) if k < len(blocks) else 0
+        while k < len(blocks):
+            child = blocks[k][i]
+            name = self.key(child)
+            if not name.startswith(prefix):
+                return
+            yield child
+            k, i = self.after(name)
+
+def nodeName(node) -> str:
+    return node.name
 
 # File Parent Class
 class File():
+    __slots__ = ("name", "parent", "owner", "perms")
     # name of the directory or file
     name: str
     # parent is a directory
-    parent = None
-    # absolute path of the directory or file
-    path: str
-    # current user upon creation determines owner
-    owner: str
-    # permission of the directory or file
-    perms: str
+    parent: "Directory"
+    # id of the user who owns it, the current user upon creation
+    owner: int
+    # permission bits of the directory or file
+    perms: int
     def __init__(self, name: str, parent):
         self.name = name
         self.parent = parent
-        self.path = self.parent.path + "/" + name
         # Owner set inside the touch method
-        self.perms = "-rw-r--"
+        self.perms = FILE_PERMS
         self.parent.add(self)
 
+    # absolute path of the file
+    @property
+    def path(self) -> str:
+        parentPath = self.parent.path
+        if parentPath == "/":
+            return "/" + self.name
+        return parentPath + "/" + self.name
+
 # Directory Child Class
 class Directory():
+    __slots__ = ("name", "parent", "owner", "perms", "contents", "index", "memo", "memo_epoch")
+    # Bumped whenever a directory is moved or renamed, which makes every memoised path stale
+    epoch = 0
     # name of the directory or file
     name: str
     # parent is a directory
-    parent = None
-    # absolute path of the directory or file
-    path: str
-    # current user upon creation determines owner
-    owner: str
-    # permission of the directory or file
-    perms: str
-    # List to store all contents of the directory
-    contents: list
+    parent: "Directory"
+    # absolute path of the directory, memoised for the epoch it was worked out in
+    memo: str
+    memo_epoch: int
+    # id of the user who owns it, the current user upon creation
+    owner: int
+    # permission bits of the directory or file
+    perms: int
+    # All contents of the directory, kept sorted by name
+    contents: SortedBlocks
+    # Dictionary mapping the name of every child to the child itself
+    index: dict
     def __init__(self, name: str, parent):
-        self.contents = []
+        self.contents = SortedBlocks(nodeName, list)
+        self.index = {}
         self.name = name
         self.parent = parent
-        if not name == "/":
-            if self.parent.path == "/":
-                self.path = self.parent.path + name
-            else:
-                self.path = self.parent.path + "/" + name
-            # self.parent.add(self)
-        else:
-            self.path = "/"
+        self.memo = None
+        self.memo_epoch = -1
+        if name == "/":
+            self.memo = "/"
             self.parent = self
-            self.owner = "root"
+            self.owner = ROOT_ID
         # Owner set inside the mkdir method
-        self.perms = "drwxr-x"
+        self.perms = DIRECTORY_PERMS
+
+    # absolute path of the directory, worked out from the chain of parents
+    @property
+    def path(self) -> str:
+        epoch = Directory.epoch
+        if self.memo_epoch != epoch and self.parent is not self:
+            # Walking up to the root or the closest ancestor whose memo is still good
+            chain = []
+            node = self
+            while node.memo_epoch != epoch and node.parent is not node:
+                chain.append(node)
+                node = node.parent
+            path = node.memo
+            for node in reversed(chain):
+                path = "/" + node.name if path == "/" else path + "/" + node.name
+                node.memo = path
+                node.memo_epoch = epoch
+        return self.memo
 
     def add(self, child):
-        self.contents.append(child)
+        self.contents.add(child)
+        self.index[child.name] = child
         return child
 
+    def remove(self, child):
+        self.contents.remove(child)
+        if self.index.get(child.name) is child:
+            del self.index[child.name]
+            # Falling back to an older child of the same name (if there is one)
+            older = self.contents.last(child.name)
+            if older is not None:
+                self.index[child.name] = older
+
+    def get(self, name: str):
+        return self.index.get(name)
+
+    # Children whose names start with prefix, in order (see SortedBlocks.scan)
+    def scan(self, prefix: str = ""):
+        return self.contents.scan(prefix)
+
+    # The SortedBlocks the children are kept in, as entries node_of gives the child for
+    @property
+    def entries(self) -> SortedBlocks:
+        return self.contents
+
+    def node_of(self, entry):
+        return entry
+
+    # Make a new file in this directory
+    def new_file(self, name: str) -> File:
+        return File(name, self)
+
+    # Make a new directory in this directory
+    def new_dir(self, name: str):
+        return self.add(Directory(name, self))
+
+    # Make an empty root directory kept by the same engine as this one
+    def new_root(self):
+        return Directory("/", None)
+
+## COLUMNAR ENGINE
+#
+# An alternative to keeping a File or Directory object per node: the whole tree lives in
+# parallel arrays indexed by row number, and the commands get short-lived handles
+# (ColumnarFile and ColumnarDirectory) that read and write those arrays. Row 0 is the root.
+
+class ColumnStore():
+    # row of the parent of every node (the root is its own parent)
+    parents: array
+    # index into name_table for every node
+    names: array
+    # permission bits of every node, the directory bit tells files and directories apart
+    perms: bytearray
+    # id of the owner of every node
+    owners: array
+    # every distinct name, and the index of each one in the table
+    name_table: list
+    name_ids: dict
+    # row of every directory -> rows of its children, sorted by name
+    children: dict
+    def __init__(self):
+        self.parents = array("i", [0])
+        self.names = array("i")
+        self.perms = bytearray([DIRECTORY_PERMS])
+        self.owners = array("i", [ROOT_ID])
+        self.name_table = []
+        self.name_ids = {}
+        self.names.append(self.intern("/"))
+        self.children = {0: SortedBlocks(self.name_of, newRowBlock)}
+        self.root = ColumnarDirectory(self, 0)
+
+    def intern(self, name: str) -> int:
+        nameId = self.name_ids.get(name)
+        if nameId is None:
+            nameId = len(self.name_table)
+            self.name_table.append(name)
+            self.name_ids[name] = nameId
+        return nameId
+
+    def name_of(self, row: int) -> str:
+        return self.name_table[self.names[row]]
+
+    # Rows are never reused, a removed node just stops being anyone's child
+    def allocate(self, name: str, parent: int, perms: int) -> int:
+        row = len(self.perms)
+        self.parents.append(parent)
+        self.names.append(self.intern(name))
+        self.perms.append(perms)
+        self.owners.append(ROOT_ID)
+        if perms & DIRECTORY_BIT:
+            self.children[row] = SortedBlocks(self.name_of, newRowBlock)
+        self.link(row, parent)
+        return row
+
+    def link(self, row: int, parent: int):
+        self.children[parent].add(row)
+
+    def unlink(self, row: int):
+        self.children[self.parents[row]].remove(row)
+
+    def handle(self, row: int):
+        if self.perms[row] & DIRECTORY_BIT:
+            return ColumnarDirectory(self, row)
+        return ColumnarFile(self, row)
+
+def newRowBlock() -> array:
+    return array("i")
+
+# Attributes shared by both kinds of handle
+class ColumnarNode():
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return isinstance(other, ColumnarNode) and self.row == other.row and self.store is other.store
+
+    def __hash__(self):
+        return hash((id(self.store), self.row))
+
+    @property
+    def name(self) -> str:
+        return self.store.name_of(self.row)
+
+    @name.setter
+    def name(self, name: str):
+        self.store.names[self.row] = self.store.intern(name)
+
+    @property
+    def parent(self):
+        return ColumnarDirectory(self.store, self.store.parents[self.row])
+
+    @parent.setter
+    def parent(self, parent):
+        self.store.parents[self.row] = parent.row
+
+    @property
+    def owner(self) -> int:
+        return self.store.owners[self.row]
+
+    @owner.setter
+    def owner(self, owner: int):
+        self.store.owners[self.row] = owner
+
+    @property
+    def perms(self) -> int:
+        return self.store.perms[self.row]
+
+    @perms.setter
+    def perms(self, perms: int):
+        self.store.perms[self.row] = perms
+
+    @property
+    def path(self) -> str:
+        store = self.store
+        names = []
+        row = self.row
+        while row != 0:
+            names.append(store.name_of(row))
+            row = store.parents[row]
+        return "/" + "/".join(reversed(names))
+
+class ColumnarFile(ColumnarNode, File):
+    __slots__ = ("store", "row")
+    def __init__(self, store: ColumnStore, row: int):
+        self.store = store
+        self.row = row
+
+class ColumnarDirectory(ColumnarNode, Directory):
+    __slots__ = ("store", "row")
+    def __init__(self, store: ColumnStore, row: int):
+        self.store = store
+        self.row = row
+
+    @property
+    def contents(self):
+        return ColumnarContents(self.store, self.store.children[self.row])
+
+    def add(self, child):
+        self.store.link(child.row, self.row)
+        return child
+
+    def remove(self, child):
+        self.store.unlink(child.row)
+
+    def get(self, name: str):
+        # The last of any children with the same name, as with the object engine
+        row = self.store.children[self.row].last(name)
+        return None if row is None else self.store.handle(row)
+
+    def scan(self, prefix: str = ""):
+        handle = self.store.handle
+        for row in self.store.children[self.row].scan(prefix):
+            yield handle(row)
+
+    @property
+    def entries(self) -> SortedBlocks:
+        return self.store.children[self.row]
+
+    def node_of(self, row: int):
+        return self.store.handle(row)
+
+    def new_file(self, name: str) -> ColumnarFile:
+        return ColumnarFile(self.store, self.store.allocate(name, self.row, FILE_PERMS))
+
+    def new_dir(self, name: str):
+        return ColumnarDirectory(self.store, self.store.allocate(name, self.row, DIRECTORY_PERMS))
+
+    def new_root(self):
+        return ColumnStore().root
+
+# Read-only view of the children of a columnar directory
+class ColumnarContents():
+    __slots__ = ("store", "rows")
+    def __init__(self, store: ColumnStore, rows: SortedBlocks):
+        self.store = store
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __iter__(self):
+        return map(self.store.handle, self.rows)
+
+    def __reversed__(self):
+        return map(self.store.handle, reversed(self.rows))
+
+# Makes an empty root directory for the given engine ("objects" or "columnar")
+def newRoot(engine: str = "objects") -> Directory:
+    if engine == "columnar":
+        return ColumnStore().root
+    return Directory("/", None)
+
+
+# LRU cache of resolved paths
+class PathCache:
+    # maximum number of paths kept
+    size: int
+    # (working directory, path) or absolute path -> (node, chain, dependencies)
+    entries: OrderedDict
+    # node or (directory, name) -> keys of the entries that depend on it
+    dependents: dict
+    # counters
+    hits: int
+    misses: int
+    evictions: int
+    def __init__(self, size: int = 4096):
+        self.size = size
+        self.entries = OrderedDict()
+        self.dependents = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry: tuple):
+        if self.size == 0:
+            return
+        self.entries[key] = entry
+        for dependency in entry[2]:
+            keys = self.dependents.get(dependency)
+            if keys is None:
+                self.dependents[dependency] = {key}
+            else:
+                keys.add(key)
+        if len(self.entries) > self.size:
+            oldest = next(iter(self.entries))
+            self.drop(oldest)
+            self.evictions += 1
+
+    def drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for dependency in entry[2]:
+            keys = self.dependents.get(dependency)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.dependents[dependency]
+
+    # Drops every entry whose walk went through the given node or (directory, name) lookup
+    def invalidate(self, dependency):
+        keys = self.dependents.pop(dependency, None)
+        if keys:
+            for key in keys:
+                self.drop(key)
+
+    def clear(self):
+        self.entries.clear()
+        self.dependents.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+# Append-only log of mutating commands, see the JOURNAL section
+class Journal:
+    # path of the journal file on the host
+    path: str
+    # snapshot the journal is replayed on top of
+    snapshot: str
+    # generation of that snapshot
+    generation: int
+    # records per group commit (0 flushes every record but never calls fsync)
+    sync_every: int
+    # size in bytes past which the journal is folded into the snapshot
+    compact_size: int
+    # bytes in the journal file and records written since the last commit
+    size: int
+    pending: int
+    def __init__(self, path: str, snapshot: str, generation: int, sync_every: int = 1, compact_size: int = 64 << 20):
+        self.path = path
+        self.snapshot = snapshot
+        self.generation = generation
+        self.sync_every = sync_every
+        self.compact_size = compact_size
+        self.file = open(path, "ab")
+        self.size = self.file.tell()
+        self.pending = 0
+
+    def append(self, fields: list):
+        payload = "\0".join(fields).encode()
+        self.file.write(JOURNAL_RECORD.pack(len(payload), zlib.crc32(payload)))
+        self.file.write(payload)
+        self.size += JOURNAL_RECORD.size + len(payload)
+        self.pending += 1
+        if self.sync_every == 0:
+            self.file.flush()
+            self.pending = 0
+        elif self.pending >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    # Starts over with an empty journal for the given snapshot generation
+    def reset(self, generation: int):
+        self.file.close()
+        writeJournalHeader(self.path, generation)
+        self.generation = generation
+        self.file = open(self.path, "ab")
+        self.size = self.file.tell()
+        self.pending = 0
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+# Every error a command can report, valued by the message the shell shows after the command's name
+class Error(Enum):
+    PERMISSION_DENIED = "Permission denied"
+    NO_SUCH_FILE_OR_DIRECTORY = "No such file or directory"
+    NO_SUCH_FILE = "No such file"
+    NOT_A_DIRECTORY = "Not a directory"
+    IS_A_DIRECTORY = "Is a directory"
+    FILE_EXISTS = "File exists"
+    DIRECTORY_NOT_EMPTY = "Directory not empty"
+    ANCESTOR_DOES_NOT_EXIST = "Ancestor directory does not exist"
+    SOURCE_IS_A_DIRECTORY = "Source is a directory"
+    DESTINATION_IS_A_DIRECTORY = "Destination is a directory"
+    DESTINATION_IS_A_FILE = "Destination is a file"
+    CANNOT_REMOVE_PWD = "Cannot remove pwd"
+    INVALID_SYNTAX = "Invalid syntax"
+    INVALID_MODE = "Invalid mode"
+    INVALID_USER = "Invalid user"
+    USER_EXISTS = "The user already exists"
+    USER_DOES_NOT_EXIST = "The user does not exist"
+    OPERATION_NOT_PERMITTED = "Operation not permitted"
+    COMMAND_NOT_FOUND = "Command not found"
+    CANNOT_WRITE_FILE = "Cannot write file"
+    INVALID_SNAPSHOT = "Invalid snapshot"
+    NO_SUCH_SNAPSHOT = "No such snapshot"
+    NO_TRANSACTION = "No transaction"
+    TRANSACTION_IN_PROGRESS = "Transaction in progress"
+    TRANSACTION_ABORTED = "Transaction aborted"
+    # deluser root, which is refused with a warning of its own rather than "deluser: ..."
+    DELETING_ROOT = """WARNING: You are just about to delete the root account
+Usually this is never required as it may render the whole system unusable
+If you really want this, call deluser with parameter --force
+(but this `deluser` does not allow `--force`, haha)
+Stopping now without having performed any action"""
+
+# An error a command reported: the command it's reported as (None if it isn't shown) and the
+# Error. Commands hand these to manager.err, and whatever shows them (the shell, the server)
+# writes them out with str, as "rm: No such file"
+class CommandError(namedtuple("CommandError", ["command", "error"])):
+    __slots__ = ()
+    def __str__(self) -> str:
+        if self.command is None:
+            return self.error.value
+        return f"{self.command}: {self.error.value}"
+
+# What a command run through Manager.call gave back: the lines it printed, the errors it reported
+# (as the shell shows them, "rm: No such file"), whether it was exit, and the Error behind each of
+# the errors
+class Result(namedtuple("Result", ["lines", "errors", "exit", "codes"])):
+    __slots__ = ()
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+# Raised by exit to end the shell, or the script, it was run from
+class ExitShell(Exception):
+    pass
+
 
 class Manager:
-    user = "root"
-    users = ["root"]
+    # name and id of the current user, see set_user
+    user: str
+    user_id: int
+    is_root: bool
+    # Users that exist now, name -> id, in the order they were added
+    users: dict
+    # Every user name seen so far and its id, nodes store the id of their owner
+    user_names: list
+    user_ids: dict
     root: Directory
     working_directory: Directory
-    # Dictionary will store all file and directory names as keys, with a list of full ls output as value
+    # Cache of resolved paths, see resolvePath
+    path_cache: PathCache
+    # Journal of mutating commands (None if journaling is off)
+    journal = None
+    # Readers-writer lock commands take when the manager is shared between threads (see
+    # SharedManager), None otherwise
+    lock = None
+    # Records that undo every change made since the oldest version still kept, each a method and
+    # its arguments, None while no version is kept (see keep_version). These are undo-log
+    # snapshots, not copies of the tree: they can be rolled back to, not read
+    undo_log = None
+    # What nodes and the namespace as a whole (root and users) were like before each change made
+    # since the oldest version of the tree someone is reading, None while no one is (see TREE
+    # VERSIONS). recording is the version the changes being made now will be published as
+    history = None
+    root_history = None
+    recording: int
+    # name of every version kept with the snapshot command -> length of undo_log when it was kept.
+    # The open transaction, if there is one, is kept as a version with no name (see begin)
+    versions: dict
+    # Whether a change in the open transaction failed, which undid the transaction
+    aborted = False
+    # Bumped every time the namespace is folded into a new snapshot
+    generation: int
+    # directory -> whether the current user can pass through every directory down to it
+    traverse_cache: dict
+    # user id -> the traverse cache of that user, kept while they aren't the current user
+    traverse_caches: dict
+    # Most entries the traverse caches hold between them before they're emptied (see drop_traverse),
+    # and how many were added since they last were
+    traverse_limit: int
+    traverse_size: int
+    # owner id -> set of the nodes that user owns, None until it's first needed (see owned_by)
+    owner_index: dict
+    # Sessions that keep a working directory of their own: clients of the server and threads of
+    # a SharedManager. They're dropped from the set once nothing else holds them
+    sessions: weakref.WeakSet
+    # Bumped every time a directory leaves the tree, so a session only has to check that its
+    # working directory is still there after this changed (see followTree)
+    unlinks = 0
+    # Where commands send the lines they print and the errors they report, both print for the
+    # shell. call points them at the lists of a Result instead
+    out: object
+    err: object
 
-    def __init__(self, root):
+    def __init__(self, root, cache_size: int = 4096, traverse_limit: int = 1 << 18):
         self.root = root
         self.working_directory = root
+        self.path_cache = PathCache(cache_size)
+        self.generation = 0
+        self.traverse_caches = {}
+        self.traverse_limit = traverse_limit
+        self.traverse_size = 0
+        self.owner_index = None
+        self.sessions = weakref.WeakSet()
+        self.versions = {}
+        # Where lines go as a command prints them, and where it reports each CommandError
+        self.out = print
+        self.err = print
+        self.user_names = ["root"]
+        self.user_ids = {"root": ROOT_ID}
+        self.users = {"root": ROOT_ID}
+        self.set_user("root")
     
     def get_working_directory(self):
         return self.working_directory
@@ -74,94 +792,608 @@ class Manager:
     def set_working_directory(self, directory: Directory):
         self.working_directory = directory
     
-    # Make a new user
+    def set_user(self, user: str):
+        self.user = user
+        self.user_id = self.intern(user)
+        self.is_root = user == "root"
+        self.traverse_cache = self.traverse_caches.setdefault(self.user_id, {})
+
+    def add_session(self, session):
+        self.sessions.add(session)
+
+    # Whether a directory is the working directory of the current user or of any session
+    def in_use(self, directory: Directory) -> bool:
+        return directory == self.working_directory or any(
+            session.working_directory == directory for session in self.sessions)
+
+    # Forgets which directories every user can pass through, after a change to who has "x" on one.
+    # Going through a copy, as threads of a SharedManager can add users' caches meanwhile
+    def clear_traverse(self):
+        for cache in list(self.traverse_caches.values()):
+            cache.clear()
+        self.traverse_size = 0
+
+    # Empties the traverse caches once they've grown past traverse_limit, and forgets those of
+    # every user but the current one
+    def drop_traverse(self):
+        self.clear_traverse()
+        self.traverse_caches = {self.user_id: self.traverse_cache}
+
+    # The "rwx" bits the current user has on a node
+    def effective(self, node) -> int:
+        if self.is_root:
+            return 0x7
+        if node.owner == self.user_id:
+            return node.perms >> 3 & 0x7
+        return node.perms & 0x7
+
+    # Whether the current user has "x" on every directory named on the way to the given one,
+    # the same check as checkPathPerms(directory.path, "x")
+    def can_traverse(self, directory: Directory) -> bool:
+        if self.is_root:
+            return True
+        root = self.root
+        if directory == root:
+            return self.effective(root) & 0x1 != 0
+        cache = self.traverse_cache
+        chain = []
+        node = directory
+        # One lookup per step, as other threads of a SharedManager may empty the cache meanwhile
+        result = None
+        while node != root:
+            result = cache.get(node)
+            if result is not None:
+                break
+            chain.append(node)
+            node = node.parent
+        if result is None:
+            result = True
+        for node in reversed(chain):
+            result = result and self.effective(node) & 0x1 != 0
+            cache[node] = result
+        self.traverse_size += len(chain)
+        if self.traverse_size > self.traverse_limit:
+            self.drop_traverse()
+        return result
+
+    # Keeps what a node is like before the version being written first changes it, for readers of
+    # the versions before (see TreeVersion). A directory's children are kept by sharing their blocks
+    def record(self, node):
+        entries = self.history.get(node)
+        if entries is None:
+            entries = self.history[node] = []
+        elif entries[-1][0] == self.recording:
+            return
+        blocks = node.entries.share() if isinstance(node, Directory) else None
+        entries.append((self.recording, NodeState(node.name, node.parent, node.owner, node.perms, blocks)))
+
+    # Notes that a node didn't exist before the version being written
+    def record_new(self, node):
+        self.history[node] = [(self.recording, MISSING)]
+
+    # Keeps the root and users before the version being written first changes either. The users
+    # kept are left as they are: the version changes a copy of them
+    def record_tree(self):
+        if not self.root_history or self.root_history[-1][0] != self.recording:
+            self.root_history.append((self.recording, (self.root, self.users, self.user_names)))
+            self.users = dict(self.users)
+
+    def set_perms(self, node, perms: int):
+        if self.history is not None:
+            self.record(node)
+        if self.undo_log is not None:
+            self.undo_log.append((Manager.set_perms, node, node.perms))
+        changed = (node.perms ^ perms) & 0x9 # "x" for the owner or for other users
+        node.perms = perms
+        if changed and isinstance(node, Directory):
+            self.clear_traverse()
+
+    def set_owner(self, node, owner: int):
+        if self.history is not None:
+            self.record(node)
+        if self.undo_log is not None:
+            self.undo_log.append((Manager.set_owner, node, node.owner))
+        if self.owner_index is not None:
+            self.owner_index[node.owner].discard(node)
+        # The owner's "x" only matters to whoever it moves between if it differs from other users'
+        changed = node.owner != owner and (node.perms >> 3 ^ node.perms) & 0x1
+        node.owner = owner
+        self.index_owner(node)
+        if changed and isinstance(node, Directory):
+            self.clear_traverse()
+
+    # Id for the given user name, handing out the next one on first use
+    def intern(self, user: str) -> int:
+        uid = self.user_ids.get(user)
+        if uid is None:
+            uid = len(self.user_names)
+            self.user_names.append(user)
+            self.user_ids[user] = uid
+        return uid
+
+    def owner_name(self, node) -> str:
+        return self.user_names[node.owner]
+
+    # The nodes owned by the given user. The index behind this is built with one walk of the tree
+    # the first time it's asked for, and kept up to date from then on.
+    def owned_by(self, owner: int) -> set:
+        if self.owner_index is None:
+            # Only handed over once it's complete, other threads may be reading it (see SharedManager)
+            index = {}
+            for node in itertools.chain([self.root], walkFiles(self, self.root)):
+                index.setdefault(node.owner, set()).add(node)
+            self.owner_index = index
+        return self.owner_index.get(owner, set())
+
+    def index_owner(self, node):
+        if self.owner_index is not None:
+            self.owner_index.setdefault(node.owner, set()).add(node)
+
+    # Runs a command the way the shell would, its words already split, and returns what it
+    # printed as a Result. Every command also has a method of its own that calls this (see COMMANDS)
+    def call(self, command: str, *words) -> Result:
+        lines = []
+        errors = []
+        out, err = self.out, self.err
+        self.out, self.err = lines.append, errors.append
+        exited = False
+        try:
+            runCommand(self, COMMANDS, [command, *words])
+        except ExitShell:
+            exited = True
+        finally:
+            self.out, self.err = out, err
+        return Result(lines, [str(error) for error in errors], exited, [error.error for error in errors])
+
+    # Make a new user, who gets back their old id if the name was used before
     def add_user(self, user: str):
-        if self.users.contains(user):
-            print("adduser: The user already exists")
+        if user in self.users:
+            self.err(CommandError("adduser", Error.USER_EXISTS))
+            return
+        if self.history is not None:
+            self.record_tree()
+        self.users[user] = self.intern(user)
+        if self.undo_log is not None:
+            self.undo_log.append((Manager.remove_user, user))
+
+    # Remove a user, returning their id. What they own keeps the id
+    def remove_user(self, user: str) -> int:
+        if self.history is not None:
+            self.record_tree()
+        if self.undo_log is not None:
+            self.undo_log.append((Manager.restore_user, user, self.users[user]))
+        return self.users.pop(user)
+
+    # Bring back a removed user with their id. They come last in the order users were added, as
+    # if added again
+    def restore_user(self, user: str, uid: int):
+        if self.history is not None:
+            self.record_tree()
+        self.users[user] = uid
+
+    # Make a new file owned by the current user
+    def create_file(self, name: str, parent: Directory) -> File:
+        if self.history is not None:
+            self.record(parent)
+        create = parent.new_file(name)
+        create.owner = self.user_id
+        if self.history is not None:
+            self.record_new(create)
+        self.index_owner(create)
+        self.path_cache.invalidate((parent, name))
+        if self.undo_log is not None:
+            self.undo_log.append((Manager.unlink, create))
+        return create
+
+    # Make a new directory owned by the current user
+    def create_dir(self, name: str, parent: Directory) -> Directory:
+        if self.history is not None:
+            self.record(parent)
+        create = parent.new_dir(name)
+        create.owner = self.user_id
+        if self.history is not None:
+            self.record_new(create)
+        self.index_owner(create)
+        self.path_cache.invalidate((parent, name))
+        if self.undo_log is not None:
+            self.undo_log.append((Manager.unlink, create))
+        return create
+
+    # Detach a file or directory from its parent
+    def unlink(self, node):
+        parent = node.parent
+        if self.history is not None:
+            self.record(node)
+            self.record(parent)
+        if self.undo_log is not None:
+            self.undo_log.append((Manager.link, node, parent, node.name))
+        parent.remove(node)
+        self.path_cache.invalidate(node)
+        self.path_cache.invalidate((parent, node.name))
+        if isinstance(node, Directory):
+            self.unlinks += 1
+            for cache in self.traverse_caches.values():
+                cache.pop(node, None)
+        if self.owner_index is not None:
+            self.owner_index[node.owner].discard(node)
+
+    # Attach a detached file or directory under a parent and name, the subtree comes along as is
+    def link(self, node, parent: Directory, name: str):
+        if self.history is not None:
+            self.record(node)
+            self.record(parent)
+        node.name = name
+        node.parent = parent
+        parent.add(node)
+        self.index_owner(node)
+        self.path_cache.invalidate((parent, name))
+        if isinstance(node, Directory):
+            Directory.epoch += 1
+            self.clear_traverse()
+        if self.undo_log is not None:
+            self.undo_log.append((Manager.unlink, node))
+
+    # Move a file or directory under a new parent and name
+    def move(self, node, parent: Directory, name: str):
+        self.unlink(node)
+        self.link(node, parent, name)
+
+    # Keep the namespace as it is now under the given name, to roll back to later. Nothing is
+    # copied: from now on every change also records how to undo it. A version can only be rolled
+    # back to, not read from while the tree moves on
+    def keep_version(self, name: str):
+        if self.undo_log is None:
+            self.undo_log = []
+        self.versions[name] = len(self.undo_log)
+
+    # Undo every change made since the version with the given name was kept, newest first.
+    # Versions kept after it are gone, it stays to be rolled back to again
+    def rollback_to(self, name: str):
+        position = self.versions[name]
+        log = self.undo_log
+        # Undoing records nothing itself
+        self.undo_log = None
+        try:
+            while len(log) > position:
+                method, *arguments = log.pop()
+                method(self, *arguments)
+        finally:
+            self.undo_log = log
+        for other in [other for other, kept in self.versions.items() if kept > position]:
+            del self.versions[other]
+        # The working directory may have been made after the version
+        if not isAttached(self, self.working_directory):
+            self.working_directory = self.root
+
+    # Stop keeping a version, along with the records no other version needs
+    def drop_version(self, name: str):
+        del self.versions[name]
+        if not self.versions:
+            self.undo_log = None
             return
-        self.users.append(user)
+        oldest = min(self.versions.values())
+        if oldest:
+            del self.undo_log[:oldest]
+            for other in self.versions:
+                self.versions[other] -= oldest
+
+    # Stop keeping any version
+    def drop_versions(self):
+        self.versions.clear()
+        self.undo_log = None
+
+    @property
+    def in_transaction(self) -> bool:
+        return None in self.versions
+
+    # Open a transaction: the changes made until it ends can be undone together
+    def start_transaction(self):
+        self.keep_version(None)
+        self.aborted = False
+
+    # End the open transaction, keeping its changes
+    def commit_transaction(self):
+        self.drop_version(None)
+
+    # End the open transaction, undoing its changes
+    def rollback_transaction(self):
+        self.rollback_to(None)
+        self.drop_version(None)
+
+    # Undo the changes of the open transaction after one of them failed. It stays open, refusing
+    # any more changes, until it's ended
+    def abort_transaction(self):
+        self.rollback_to(None)
+        self.aborted = True
 
 
 def main():
+    parser = argparse.ArgumentParser(description="A virtual file system shell")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="run the commands in FILE (- for standard input) without prompts")
+    parser.add_argument("--load", metavar="SNAPSHOT",
+                        help="start from a namespace saved with the save command")
+    parser.add_argument("--engine", choices=["objects", "columnar"], default="objects",
+                        help="keep the tree as one object per node (default) or in parallel arrays")
+    parser.add_argument("--journal", metavar="FILE",
+                        help="log every change to FILE and replay it on startup")
+    parser.add_argument("--fsync-every", metavar="N", type=int, default=1,
+                        help="records written per fsync of the journal (0 never calls fsync)")
+    parser.add_argument("--compact-size", metavar="BYTES", type=int, default=64 << 20,
+                        help="fold the journal into its snapshot once it grows past BYTES")
+    parser.add_argument("--serve", metavar="ADDRESS",
+                        help="share the namespace with clients of a Unix socket, or of HOST:PORT over TCP")
+    options = parser.parse_args()
+    if options.serve is not None and options.batch is not None:
+        parser.error("--serve and --batch can't be used together")
     
-    commands_list = ["exit", "pwd", "cd", "mkdir", "touch", "cp", "mv", "rm", "rmdir", "chmod", "chown", "adduser", "deluser", "su", "ls"]
-    # Dictionary to store functions for all the possible commands
-    commands = {"exit": exit,
-                "pwd": pwd,
-                "cd": cd,
-                "mkdir": mkdir,
-                "touch": touch,
-                "cp": cp,
-                "mv": mv,
-                "rm": rm,
-                "rmdir": rmdir,
-                "chmod": chmod,
-                "chown": chown,
-                "adduser": adduser,
-                "deluser": deluser,
-                "su": su,
-                "ls": ls}
+    commands = COMMANDS
     # Making the root directory and namespace manager
-    manager = Manager(Directory("/", None))
+    manager = Manager(newRoot(options.engine))
+    snapshot = options.load
+    if options.journal is not None and snapshot is None:
+        snapshot = options.journal + ".snap"
+    if snapshot is not None and (options.load is not None or os.path.exists(snapshot)):
+        try:
+            loadSnapshot(manager, snapshot)
+        except OSError:
+            parser.error(f"{snapshot}: No such file")
+        except ValueError:
+            parser.error(f"{snapshot}: Invalid snapshot")
+    if options.journal is not None:
+        try:
+            openJournal(manager, commands, options.journal, snapshot, options.fsync_every, options.compact_size)
+        except OSError:
+            parser.error(f"{options.journal}: Cannot open journal")
+        except ValueError as error:
+            parser.error(f"{options.journal}: {error}")
 
-    # Keeping the program going
-    while True:
-        inp = input(f"{manager.user}:{manager.working_directory.path}$ ")
-        inputs = shlex.split(inp) # shlex will preserve quoted strings
-        if not inputs:
-            continue
-        if len(inputs) == 1:
-            command = inputs[0]
-            if command not in commands:
-                print(f"{command}: Command not found")
-                continue
+    try:
+        if options.serve is not None:
+            try:
+                asyncio.run(serve(manager, commands, options.serve))
+            except KeyboardInterrupt:
+                pass
+            return
+
+        if options.batch is not None:
+            if options.batch == "-":
+                runBatch(manager, commands, sys.stdin)
             else:
-                commands[command](manager)
-        else:
-            command = inputs.pop(0)
-            if command not in commands:
-                print(f"{command}: Command not found")
-            commands[command](manager, inputs)
-        
+                with open(options.batch) as script:
+                    runBatch(manager, commands, script)
+            return
+
+        # Keeping the program going
+        while True:
+            inp = input(f"{manager.user}:{manager.working_directory.path}$ ")
+            runLine(manager, commands, inp)
+    except ExitShell:
+        pass
+    finally:
+        # A transaction that wasn't committed never happened
+        if manager.in_transaction:
+            runCommand(manager, commands, ["rollback"])
+        if manager.journal is not None:
+            manager.journal.close()
+
+# Parses one input line and calls the matching command
+def runLine(manager: Manager, commands: dict, inp: str) -> bool:
+    try:
+        inputs = splitLine(inp)
+    except ValueError: # a quote that isn't closed
+        manager.err(CommandError(inp.split()[0], Error.INVALID_SYNTAX))
+        return True
+    if not inputs:
+        return False
+    runCommand(manager, commands, inputs)
+    return True
+
+# Characters str.split and shlex treat differently: quotes and escapes, and the ASCII whitespace
+# shlex doesn't split on
+SHLEX_CHARS = re.compile(r"[\"'\\\x0b\x0c\x1c-\x1f]")
+
+# The words of a line as shlex.split gives them (keeping quoted strings together), splitting
+# plain ASCII lines with no quotes or escapes with str.split, which is far quicker
+def splitLine(line: str) -> list:
+    if line.isascii() and SHLEX_CHARS.search(line) is None:
+        return line.split()
+    return shlex.split(line)
+
+# Calls the command named by the first element of inputs with the rest as its arguments
+def runCommand(manager: Manager, commands: dict, inputs: list):
+    command = inputs.pop(0)
+    if command not in commands:
+        manager.err(CommandError(command, Error.COMMAND_NOT_FOUND))
+        return
+    lock = manager.lock
+    if lock is None:
+        runWords(manager, commands, command, inputs)
+        return
+    if lock.holder == threading.get_ident():
+        # The thread's own transaction, which holds the lock from begin until it ends
+        try:
+            runWords(manager, commands, command, inputs)
+        finally:
+            if not manager.in_transaction:
+                manager.release(True)
+        return
+    # Reads of the whole tree run on the last version published, without the lock
+    if command in VERSIONED_COMMANDS:
+        tree = manager.read_version()
+        try:
+            runWords(tree, commands, command, inputs)
+        finally:
+            manager.done_reading(tree)
+        return
+    # Commands that change the namespace run alone, the rest alongside each other
+    writing = command in WRITING_COMMANDS
+    manager.acquire(writing)
+    try:
+        manager.follow_tree()
+        runWords(manager, commands, command, inputs)
+    finally:
+        if not (writing and manager.in_transaction):
+            manager.release(writing)
+
+def runWords(manager: Manager, commands: dict, command: str, inputs: list):
+    if command not in CHANGING_COMMANDS or not manager.in_transaction:
+        applyWords(manager, commands, command, inputs)
+        return
+    # In a transaction, a change that fails undoes every change before it
+    if manager.aborted:
+        manager.err(CommandError(command, Error.TRANSACTION_ABORTED))
+        return
+    failed = False
+    err = manager.err
+    def report(error: CommandError):
+        nonlocal failed
+        failed = True
+        err(error)
+    manager.err = report
+    try:
+        applyWords(manager, commands, command, inputs)
+    finally:
+        manager.err = err
+    if failed:
+        manager.abort_transaction()
+
+# Logs the command to the journal, expands its patterns and runs it if its words fit its syntax
+def applyWords(manager: Manager, commands: dict, command: str, inputs: list):
+    journal = manager.journal
+    if journal is not None and command in JOURNALED_COMMANDS:
+        # Written ahead of running the command, which replays the same way from the same state
+        journal.append([manager.user, manager.working_directory.path, command] + inputs)
+    words = inputs
+    if any(isPattern(word) for word in inputs):
+        words = expandWords(manager, inputs)
+        if command not in STREAMED_COMMANDS:
+            words = list(words)
+    syntax = commands[command]
+    parsed = parseCommand(manager, command, syntax, words)
+    if parsed is not None:
+        syntax.function(manager, parsed)
+    # Not while versions are kept, the journal is what brings them back after a restart
+    if journal is not None and journal.size >= journal.compact_size and manager.undo_log is None:
+        compactJournal(manager)
+
+# Runs every line of a script with no prompts, writing output through one buffered writer
+def runBatch(manager: Manager, commands: dict, script) -> int:
+    out = open(sys.stdout.fileno(), "w", buffering=1 << 16, closefd=False)
+    stdout = sys.stdout
+    sys.stdout = out
+    count = 0
+    start = time.perf_counter()
+    try:
+        for inp in script:
+            if runLine(manager, commands, inp):
+                count += 1
+    except ExitShell: # "exit" ends the script
+        count += 1
+    finally:
+        sys.stdout = stdout
+        out.close()
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed > 0 else 0
+    print(f"{count} commands in {elapsed:.3f}s ({rate:.0f} commands/s)", file=sys.stderr)
+    return count
+
+## COMMAND SYNTAX
+#
+# Every command is listed in COMMANDS with the syntax its words are checked against before it
+# runs, so the commands themselves start from arguments that fit:
+#   function     the command, called with the manager and the parsed Command
+#   root         only root can run it, checked before the syntax
+#   flags        options that can come first, each mapped to how many values follow it. Only one
+#                is taken, and only when at least one operand (and the least there can be) follows
+#   least, most  how many operands it takes, most being None for no limit
+#   paths        whether the operands have to be valid paths, checked before it runs. Commands
+#                that take any number of paths check each one as they get to it instead
+#   alias        the command syntax errors are reported as, if not its own name
+#   switches     flags that take no value and can come first in any number and order
+#   options      options that come in pairs after the operands (as many as most allows), each
+#                mapped to the check its value has to pass, None if any value will do
+
+class Syntax(namedtuple("Syntax", ["function", "root", "flags", "least", "most", "paths", "alias", "switches", "options"])):
+    __slots__ = ()
+    def __new__(cls, function, root=False, flags=None, least=0, most=0, paths=False, alias=None, switches=None, options=None):
+        return super().__new__(cls, function, root, flags or {}, least, most, paths, alias,
+                               frozenset(switches or ()), options or {})
+
+# A command's words once they've been checked: the option given (None if there isn't one), the
+# values that came with it, the operands after it, the switches given and the options' values
+Command = namedtuple("Command", ["option", "values", "operands", "switches", "settings"])
+
+# Checks words against the syntax of the named command, returning the Command to run or None
+# after printing what's wrong. Expanded words are only read as far as the check needs
+def parseCommand(manager: Manager, name: str, syntax: Syntax, words) -> Command:
+    function, root, flags, least, most, paths, alias, switches, options = syntax
+    if root and not manager.is_root:
+        manager.err(CommandError(name, Error.OPERATION_NOT_PERMITTED))
+        return None
+    option = None
+    values = ()
+    given = frozenset()
+    settings = {}
+    if switches:
+        first = 0
+        while countWords(words, first + 1) > first and words[first] in switches:
+            first += 1
+        given = frozenset(words[i] for i in range(first))
+        words = words[first:]
+    if flags and words and words[0] in flags:
+        taken = flags[words[0]]
+        needed = 1 + taken + max(least, 1)
+        if countWords(words, needed) == needed:
+            option = words[0]
+            values = tuple(words[i] for i in range(1, 1 + taken))
+            words = words[1 + taken:]
+    if options:
+        words = list(words)
+        pairs = list(zip(words[most::2], words[most + 1::2]))
+        if len(words[most:]) % 2 or not all(key in options and (options[key] is None or options[key](value))
+                                             for key, value in pairs):
+            manager.err(CommandError(alias or name, Error.INVALID_SYNTAX))
+            return None
+        settings = dict(pairs)
+        words = words[:most]
+    # Plain words are counted outright, expanded ones no further than the check needs
+    count = len(words) if type(words) is list else countWords(words, least if most is None else most + 1)
+    if count < least or most is not None and count > most or paths and not all(map(isValidPath, words)):
+        manager.err(CommandError(alias or name, Error.INVALID_SYNTAX))
+        return None
+    return Command(option, values, words, given, settings)
+
+# How many words there are, counting no further than n
+def countWords(words, n: int) -> int:
+    if isinstance(words, Words):
+        return min(words.fill(n), n)
+    return min(len(words), n)
+
 ###
 ### COMMANDS AS FUNCTIONS
 ### 
 # exit
-def exit(manager: Manager, *args):
-    if len(args) != 0:
-        print("exit: Invalid syntax")
-        return
-    print(f"bye, {manager.user}")
-    sys.exit()
+def exit(manager: Manager, command: Command):
+    manager.out(f"bye, {manager.user}")
+    raise ExitShell()
 
 # pwd
-def pwd(manager: Manager, *args):
-    if len(args) != 0:
-        print("pwd: Invalid syntax")
-        return
-    print(manager.working_directory.path)
+def pwd(manager: Manager, command: Command):
+    manager.out(manager.working_directory.path)
 
 # cd
-def cd(manager: Manager, *args):
-    # If there's no arguments
-    if len(args) == 0:
-        print("cd: Invalid syntax")
-        return
-    # If there's too many  arguments
-    elif len(args[0]) > 1:
-        print("cd: Invalid syntax")
-        return
-    inputs = args[0]
-    path = inputs[0]
+def cd(manager: Manager, command: Command):
+    path = command.operands[0]
     if path[-1] == "/" and path != "/": # Trimming the last slash (if there is one)
         path = path[:-1]
     # If path is invalid
     if not checkPath(manager, path):
-        print("cd: No such file or directory")
+        manager.err(CommandError("cd", Error.NO_SUCH_FILE_OR_DIRECTORY))
         return
     # If destination is a file and not a directory
     if not isinstance(checkPath(manager, path), Directory):
-        print("cd: Destination is a file")
+        manager.err(CommandError("cd", Error.DESTINATION_IS_A_FILE))
         return
     # Checking permission for the whole path given
     toEnter = checkPathPerms(manager, path, "x") # will return object if permissions are fine, False otherwise
@@ -169,230 +1401,147 @@ def cd(manager: Manager, *args):
         manager.working_directory = toEnter
         return
     else:
-        print("cd: Permission denied")
+        manager.err(CommandError("cd", Error.PERMISSION_DENIED))
     
 # mkdir
-def mkdir(manager: Manager, *args):
-    # If incorrect number of arguments are passed
-    if len(args) == 0:
-        print("mkdir: Invalid syntax")
-        return
-    elif len(args[0]) > 2:
-        print("mkdir: Invalid syntax")
-        return
+def mkdir(manager: Manager, command: Command):
+    flag = command.option == "-p"
 
-    inputs = args[0]
-    flag = False
-    name = ""
-    if len(inputs) == 1:
-        path = inputs[0]
-        if path[-1] == "/":
-            path = path[:-1]
-        name = inputs[0]
-    elif len(inputs) == 2 and inputs[0] == "-p":
-        path = inputs[1]
+    # Parent directories found so far, shared by paths in the same directory
+    parents = {}
+    for i, path in enumerate(command.operands):
+        # "-p" only goes before the paths
+        if path == "-p" and i > 0:
+            manager.err(CommandError("mkdir", Error.INVALID_SYNTAX))
+            continue
         if path[-1] == "/":
             path = path[:-1]
+        # If invalid characters are passed
+        if not isValidPath(path):
+            manager.err(CommandError("mkdir", Error.INVALID_SYNTAX))
+            continue
         arr = path.split("/")
-        flag = True
-        name = path[:-(len(arr[-1]))]
-    elif len(inputs) == 2:
-        print("mkdir: Invalid syntax")
-        return
-    
-    arr = path.split("/")
-    # If invalid characters are passed
-    for str in arr:
-        if not isValid(str):
-            print("mkdir: Invalid syntax")
-            return
 
-    if path[-1] == "/":
-        name = path[-(len(arr[-1])+1) : -1]
-    else:
-        name = path[-(len(arr[-1])) : ]
-        
-    if not flag:
-        if checkPath(manager, path):
-            print("mkdir: File exists")
-            return
-        absolute = False
-        if path[0] == "/":
-            absolute = True
-        if not absolute: # If path is relative
-            if len(arr) == 1:
-                if checkPerm(manager, manager.working_directory, "w"):
-                    create = Directory(name, manager.working_directory)
-                    manager.working_directory.add(create)
-                    create.owner = manager.user
-                    return
-                else:
-                    print("mkdir: Permission denied")
-                    return
-        else: # If path is absolute
-            arr.pop(0) # remove first element, which is ""
-            if len(arr) == 1: # Means we need to use root directory
-                create = Directory(name, manager.root)
-                manager.root.add(create)
-                create.owner = manager.user
-                return
-        tempPath = path[:-(len(arr[-1])+1)] # Slicing path to remove the last element, including the slash
-        if tempPath == "":
-            tempPath = "/"
-        # If ancestors don't exist
-        destination = checkPath(manager, tempPath)
-        if not destination:
-            print("mkdir: Ancestor directory does not exist")
-            return
-        dirAncPath = destination.parent.path[:-(len(destination.parent.name)+1)]
-        if dirAncPath == "":
-            dirAncPath = "/"
-        if checkPathPerms(manager, dirAncPath, "x"):
-            if checkPerm(manager, destination, "w"):
-                create = Directory(name, destination)
-                destination.add(create)
-                create.owner = manager.user
-            else:
-                print("mkdir: Permission denied")
-                return
+        if path[-1] == "/":
+            name = path[-(len(arr[-1])+1) : -1]
         else:
-            print("mkdir: Permission denied")
-            return
-    elif flag: # FLAG
-        absolute = False
-        if path[0] == "/":
-            absolute = True
-        if not absolute: # If path is relative
-            if len(arr) == 1:
-                if checkPerm(manager, manager.working_directory, "w"):
-                    create = Directory(name, manager.working_directory)
-                    manager.working_directory.add(create)
-                    create.owner = manager.user
-                    return  
-                else:
-                    print("mkdir: Permission denied")
-                    return
+            name = path[-(len(arr[-1])) : ]
+
+        if not flag:
+            if checkOperand(manager, path, parents):
+                manager.err(CommandError("mkdir", Error.FILE_EXISTS))
+                continue
+            absolute = False
+            if path[0] == "/":
+                absolute = True
+            if not absolute: # If path is relative
+                if len(arr) == 1:
+                    if checkPerm(manager, manager.working_directory, "w"):
+                        manager.create_dir(name, manager.working_directory)
+                    else:
+                        manager.err(CommandError("mkdir", Error.PERMISSION_DENIED))
+                    continue
+            else: # If path is absolute
+                arr.pop(0) # remove first element, which is ""
+                if len(arr) == 1: # Means we need to use root directory
+                    manager.create_dir(name, manager.root)
+                    continue
             tempPath = path[:-(len(arr[-1])+1)] # Slicing path to remove the last element, including the slash
-        else: # If path is absolute
-            arr.pop(0) # remove first element, which is ""
-            if len(arr) == 1: # Means we need to use root directory
-                create = Directory(name, manager.root)
-                manager.root.add(create)
-                create.owner = manager.user
-                return
-            tempPath = path[1:-(len(arr[-1])+1)] # Slicing path to remove the last element, including the slash
-                
-        if tempPath == "":
-            tempPath = "/"
-        current = manager.working_directory
-        tempArr = tempPath.split("/")
-        i = 0
-        while i < len(tempArr):
-            exists = False
-            for thing in current.contents:
-                if thing.name == tempArr[i] and isinstance(thing, Directory):
+            if tempPath == "":
+                tempPath = "/"
+            # If ancestors don't exist
+            destination = checkParent(manager, tempPath, parents)
+            if not destination:
+                manager.err(CommandError("mkdir", Error.ANCESTOR_DOES_NOT_EXIST))
+                continue
+            if manager.can_traverse(destination.parent.parent) and checkPerm(manager, destination, "w"):
+                manager.create_dir(name, destination)
+            else:
+                manager.err(CommandError("mkdir", Error.PERMISSION_DENIED))
+        else: # FLAG
+            absolute = False
+            if path[0] == "/":
+                absolute = True
+            if not absolute: # If path is relative
+                if len(arr) == 1:
+                    if checkPerm(manager, manager.working_directory, "w"):
+                        manager.create_dir(name, manager.working_directory)
+                    else:
+                        manager.err(CommandError("mkdir", Error.PERMISSION_DENIED))
+                    continue
+                tempPath = path[:-(len(arr[-1])+1)] # Slicing path to remove the last element, including the slash
+            else: # If path is absolute
+                arr.pop(0) # remove first element, which is ""
+                if len(arr) == 1: # Means we need to use root directory
+                    manager.create_dir(name, manager.root)
+                    continue
+                tempPath = path[1:-(len(arr[-1])+1)] # Slicing path to remove the last element, including the slash
+
+            if tempPath == "":
+                tempPath = "/"
+            current = manager.working_directory
+            for part in tempPath.split("/"):
+                thing = current.get(part)
+                if isinstance(thing, Directory):
                     current = thing
-                    exists = True
-            
-            if not exists:
-                create = Directory(tempArr[i], current)
-                current = current.add(create)
-                create.owner = manager.user
-            i += 1
+                else:
+                    current = manager.create_dir(part, current)
 
-        destination = checkPath(manager, tempPath)
-        dirAncPath = destination.parent.path[:-(len(destination.parent.name)+1)]
-        if dirAncPath == "":
-            dirAncPath = "/"
-        # print(tempPath)
-        if checkPathPerms(manager, dirAncPath, "x"):
-            if checkPerm(manager, destination, "w"):
-                # print(tempDir.path)
-                create = Directory(name, destination)
-                destination.add(create)
-                create.owner = manager.user
+            destination = checkParent(manager, tempPath, parents)
+            if manager.can_traverse(destination.parent.parent) and checkPerm(manager, destination, "w"):
+                manager.create_dir(name, destination)
             else:
-                print("mkdir: Permission denied")
-                return
-        else:
-            print("mkdir: Permission denied")
-            return
+                manager.err(CommandError("mkdir", Error.PERMISSION_DENIED))
 
 # touch
-def touch(manager: Manager, *args):
-    # If there's no arguments
-    if len(args) == 0:
-        print("touch: Invalid syntax")
-        return
-    # If there's too many  arguments
-    elif len(args[0]) > 1:
-        print("touch: Invalid syntax")
-        return
-    inputs = args[0]
-    path = inputs[0]
-    arr = path.split("/")
-    # If invalid characters are passed
-    for str in arr:
-        if not isValid(str):
-            print("touch: Invalid syntax")
-            return
+def touch(manager: Manager, command: Command):
+    # Parent directories found so far, shared by paths in the same directory
+    parents = {}
+    for path in command.operands:
+        # If invalid characters are passed
+        if not isValidPath(path):
+            manager.err(CommandError("touch", Error.INVALID_SYNTAX))
+            continue
+        arr = path.split("/")
 
-    name = path[-(len(arr[-1])) : ] # trimming path and only getting name of file
-    if path[0] == "/":
-        absolute = True
-    else:
-        absolute = False
-    if path[-1] == "/" and path != "/": # Trimming the last slash (if there is one)
-        path = path[:-1]
-    # If file already exists
-    if checkPath(manager, path):
-        return
+        name = path[-(len(arr[-1])) : ] # trimming path and only getting name of file
+        if path[0] == "/":
+            absolute = True
+        else:
+            absolute = False
+        if path[-1] == "/" and path != "/": # Trimming the last slash (if there is one)
+            path = path[:-1]
+        # If file already exists
+        if checkOperand(manager, path, parents):
+            continue
 
-    if not absolute:
-        if len(arr) == 1:
-            if checkPathPerms(manager, manager.working_directory.path, "x") and checkPerm(manager, manager.working_directory, "w"):
-                create = File(name, manager.working_directory)
-                create.owner = manager.user
-                return create
-            else:
-                print("touch: Permission denied")
-                return
-    else:
-        arr.pop(0)
-        if len(arr) == 1:
-            create = File(name, manager.root)
-            create.owner = manager.user
-            return create
-    # If file needs to be created by following path
-    tempPath = path[ : -(len(arr[-1])+1)] # removing name of file to only get path
-    destination = checkPath(manager, tempPath)
-    if not destination:
-        print("touch: Ancestor directory does not exist")
-        return
-    if checkPathPerms(manager, destination.path, "x"): # Checking "x" permission for ancestors
-        if checkPerm(manager, destination, "w"): # Checking "w" permission for parent
-            create = File(name, destination)
-            create.owner = manager.user
-            return create
+        if not absolute:
+            if len(arr) == 1:
+                if manager.can_traverse(manager.working_directory) and checkPerm(manager, manager.working_directory, "w"):
+                    manager.create_file(name, manager.working_directory)
+                else:
+                    manager.err(CommandError("touch", Error.PERMISSION_DENIED))
+                continue
         else:
-            print("touch: Permission denied")
-            return
-    else:
-        print("touch: Permission denied")
-        return
+            arr.pop(0)
+            if len(arr) == 1:
+                manager.create_file(name, manager.root)
+                continue
+        # If file needs to be created by following path
+        tempPath = path[ : -(len(arr[-1])+1)] # removing name of file to only get path
+        destination = checkParent(manager, tempPath, parents)
+        if not destination:
+            manager.err(CommandError("touch", Error.ANCESTOR_DOES_NOT_EXIST))
+            continue
+        # Checking "x" permission for ancestors and "w" permission for parent
+        if manager.can_traverse(destination) and checkPerm(manager, destination, "w"):
+            manager.create_file(name, destination)
+        else:
+            manager.err(CommandError("touch", Error.PERMISSION_DENIED))
 
 # cp
-def cp(manager: Manager, *args):
-    # If incorrect number of arguments are passed
-    if len(args) == 0:
-        print("cp: Invalid syntax")
-        return
-    elif len(args[0]) != 2:
-        print("cp: Invalid syntax")
-        return
-    
-    src = args[0][0] # source path
-    dst = args[0][1] # destination path
+def cp(manager: Manager, command: Command):
+    src, dst = command.operands # source and destination paths
     srcArr = src.split("/") # file path
     dstArr = dst.split("/") # directory path
     name = dst[-(len(dstArr[-1])) : ] # trimming path and only getting name of file
@@ -408,79 +1557,55 @@ def cp(manager: Manager, *args):
         dstParPath = dst[:-(len(dstArr[-1])+1)]
 
     ## ERROR HANDLING
-    # If invalid characters are passed
-    for str in srcArr:
-        if not isValid(str):
-            print("cp: Invalid syntax")
-            return
-    for str in dstArr:
-        if not isValid(str):
-            print("cp: Invalid syntax")
-            return
-    
     # If src file does not exist
     source = checkPath(manager, src)
     if not source:
-        print("cp: No such file")
+        manager.err(CommandError("cp", Error.NO_SUCH_FILE))
         return
     # If dst already exists
     if isinstance(checkPath(manager, dst), File):
-        print("cp: File exists")
+        manager.err(CommandError("cp", Error.FILE_EXISTS))
         return
     elif isinstance(checkPath(manager, dst), Directory):
-        print("cp: Destination is a directory")
+        manager.err(CommandError("cp", Error.DESTINATION_IS_A_DIRECTORY))
         return
     # If src is a directory
     if isinstance(checkPath(manager, src), Directory):
-        print("cp: Source is a directory")
+        manager.err(CommandError("cp", Error.SOURCE_IS_A_DIRECTORY))
         return
     # If dst's parent does not exist
     destination = checkPath(manager, dstParPath)
     if not destination:
-        print("cp: No such file or directory")
+        manager.err(CommandError("cp", Error.NO_SUCH_FILE_OR_DIRECTORY))
         return
     elif isinstance(destination, File):
-        print("cp: No such file or directory")
+        manager.err(CommandError("cp", Error.NO_SUCH_FILE_OR_DIRECTORY))
         return
     
-    dstAncPath = destination.path[:-(len(destination.name)+1)]
-    if dstAncPath == "":
-        dstAncPath = "/"
-    srcAncPath = source.parent.path
 
     # Permission "r" on src
     if not checkPerm(manager, source, "r"):
-        print("cp: Permission denied")
+        manager.err(CommandError("cp", Error.PERMISSION_DENIED))
         return
     # Permission "x" on src ancestors
-    if not checkPathPerms(manager, srcAncPath, "x"):
-        print("cp: Permission denied")
+    if not manager.can_traverse(source.parent):
+        manager.err(CommandError("cp", Error.PERMISSION_DENIED))
         return
     # Permission "x" on dst ancestors
-    if not checkPathPerms(manager, dstAncPath, "x"):
-        print("cp: Permission denied")
+    if not manager.can_traverse(destination.parent):
+        manager.err(CommandError("cp", Error.PERMISSION_DENIED))
         return
     # Permission "w" on dst parent
     if not checkPerm(manager, destination, "w"):
-        print("cp: Permission denied")
+        manager.err(CommandError("cp", Error.PERMISSION_DENIED))
         return
 
     # Actually copying the file
-    create = File(name, destination)
-    create.owner = manager.user
+    manager.create_file(name, destination)
 
 # mv
-def mv(manager: Manager, *args):
-    # If incorrect number of arguments are passed
-    if len(args) == 0:
-        print("mv: Invalid syntax")
-        return
-    elif len(args[0]) != 2:
-        print("mv: Invalid syntax")
-        return
-    
-    src = args[0][0] # source path
-    dst = args[0][1] # destination path
+def mv(manager: Manager, command: Command):
+    src, dst = command.operands # source and destination paths
     srcArr = src.split("/") # file path
     if srcArr[0] == "":
         srcArr.pop(0)
@@ -501,559 +1626,334 @@ def mv(manager: Manager, *args):
 
 
     ## ERROR HANDLING
-    # If invalid characters are passed
-    for str in srcArr:
-        if not isValid(str):
-            print("mv: Invalid syntax")
-            return
-    for str in dstArr:
-        if not isValid(str):
-            print("mv: Invalid syntax")
-            return
-    
     # If dst already exists
     if isinstance(checkPath(manager, dst), File):
-        print("mv: File exists")
+        manager.err(CommandError("mv", Error.FILE_EXISTS))
         return
     # If src file does not exist
     source = checkPath(manager, src)
     if not source:
-        print("mv: No such file")
+        manager.err(CommandError("mv", Error.NO_SUCH_FILE))
         return
     elif isinstance(checkPath(manager, dst), Directory):
-        print("mv: Destination is a directory")
+        manager.err(CommandError("mv", Error.DESTINATION_IS_A_DIRECTORY))
         return
     # If src is a directory
     if isinstance(checkPath(manager, src), Directory):
-        print("mv: Source is a directory")
+        manager.err(CommandError("mv", Error.SOURCE_IS_A_DIRECTORY))
         return
     # If dst's parent does not exist
     destination = checkPath(manager, dstParPath)
     if not destination:
-        print("mv: No such file or directory")
+        manager.err(CommandError("mv", Error.NO_SUCH_FILE_OR_DIRECTORY))
         return
     elif isinstance(destination, File):
-        print("mv: No such file or directory")
+        manager.err(CommandError("mv", Error.NO_SUCH_FILE_OR_DIRECTORY))
         return
     
     sourceDir = checkPath(manager, srcParPath) # Stores the src parent directory
-    dstAncPath = destination.path[:-(len(destination.name)+1)]
-    if dstAncPath == "":
-        dstAncPath = "/"
-    srcAncPath = sourceDir.path[:-(len(sourceDir.name)+1)]
-    if srcAncPath == "":
-        srcAncPath = "/"
 
     # Permission "x" on src ancestors
-    if not checkPathPerms(manager, srcAncPath, "x"):
-        print("mv: Permission denied")
+    if not manager.can_traverse(sourceDir.parent):
+        manager.err(CommandError("mv", Error.PERMISSION_DENIED))
     # Permission "w" on src parent
     if not checkPerm(manager, sourceDir, "w"):
-        print("mv: Permission denied")
+        manager.err(CommandError("mv", Error.PERMISSION_DENIED))
         return
     # Permission "x" on dst ancestors
-    if not checkPathPerms(manager, dstAncPath, "x"):
-        print("mv: Permission denied")
+    if not manager.can_traverse(destination.parent):
+        manager.err(CommandError("mv", Error.PERMISSION_DENIED))
         return
     # Permission "w" on dst parent
     if not checkPerm(manager, destination, "w"):
-        print("mv: Permission denied")
+        manager.err(CommandError("mv", Error.PERMISSION_DENIED))
         return
 
-    # Actually moving the file
-    create = File(name, destination)
-    create.owner = manager.user
-    parentList = source.parent.contents
-    parentList.remove(source)
-    del source
+    # Actually moving the file, which ends up as a new file of the current user
+    manager.move(source, destination, name)
+    manager.set_owner(source, manager.user_id)
+    manager.set_perms(source, FILE_PERMS)
 
 # rm
-def rm(manager: Manager, *args):
-    if len(args) == 0:
-        print("rm: Invalid syntax")
-        return
-    elif len(args[0]) > 1:
-        print("rm: Invalid syntax")
-        return
-    
-    inputs = args[0]
-    path = inputs[0]
-    arr = path.split("/")
-    # If invalid characters are passed
-    for str in arr:
-        if not isValid(str):
-            print("rm: Invalid syntax")
-            return
+def rm(manager: Manager, command: Command):
+    # Parent directories found so far, shared by paths in the same directory
+    parents = {}
+    for path in command.operands:
+        # If invalid characters are passed
+        if not isValidPath(path):
+            manager.err(CommandError("rm", Error.INVALID_SYNTAX))
+            continue
 
-    file = checkPath(manager, path)
-    if not file:
-        print("rm: No such file")
-        return
-    elif isinstance(file, Directory):
-        print("rm: Is a directory")
-        return
-    
-    fileAncPath = file.parent.path[:-(len(file.parent.name)+1)]
-    if fileAncPath == "":
-        fileAncPath = "/"
-    # Permission "w" on file
-    if not checkPerm(manager, file, "w"):
-        print("rm: Permission denied")
-        return
-    # Permission "x" on file ancestors
-    if not checkPathPerms(manager, fileAncPath, "x"):
-        print("rm: Permission denied")
-        return
-    # Permission "w" on dile parent
-    if not checkPerm(manager, file.parent, "w"):
-        print("rm: Permission denied")
-        return
-    
-    # Removing the file
-    parentList = file.parent.contents
-    parentList.remove(file)
-    del file
+        file = checkOperand(manager, path, parents)
+        if not file:
+            manager.err(CommandError("rm", Error.NO_SUCH_FILE))
+            continue
+        elif isinstance(file, Directory):
+            manager.err(CommandError("rm", Error.IS_A_DIRECTORY))
+            continue
+
+        # Permission "w" on file, "x" on file ancestors and "w" on file parent
+        if not (checkPerm(manager, file, "w") and manager.can_traverse(file.parent.parent)
+                and checkPerm(manager, file.parent, "w")):
+            manager.err(CommandError("rm", Error.PERMISSION_DENIED))
+            continue
+
+        # Removing the file
+        manager.unlink(file)
 
 # rmdir
-def rmdir(manager: Manager, *args):
-    if len(args) == 0:
-        print("rmdir: Invalid syntax")
-        return
-    elif len(args[0]) > 1:
-        print("rmdir: Invalid syntax")
-        return
-    
-    inputs = args[0]
-    path = inputs[0]
-    arr = path.split("/")
-    # If invalid characters are passed
-    for str in arr:
-        if not isValid(str):
-            print("rmdir: Invalid syntax")
-            return
-    dir = checkPath(manager, path)
-    # If directory does not exist
-    if not dir:
-        print("rmdir: No such file or directory")
-        return
-    # If path exists but is not a directory
-    if not isinstance(dir, Directory):
-        print("rmdir: Not a directory")
-        return
-    # If directory is not empty
-    if dir.contents:
-        print("rmdir: Directory not empty")
-        return
-    # If directory is working directory
-    if dir == manager.working_directory:
-        print("rmdir: Cannot remove pwd")
-        return
-    
-    dirAncPath = dir.parent.path[:-(len(dir.parent.name)+1)]
-    if dirAncPath == "":
-        dirAncPath = "/"
-    # Permission "x" on directory ancestors
-    if not checkPathPerms(manager, dir.parent.path, "x"):
-        print("rmdir: Permission denied")
-        return
-    # Permission "w" on directory parent
-    if not checkPerm(manager, dir.parent, "w"):
-        print("rmdir: Permission denied")
-        return
-    
-    # Removing the directory
-    parentList = dir.parent.contents
-    parentList.remove(dir)
-    del dir
-  
+def rmdir(manager: Manager, command: Command):
+    # Parent directories found so far, shared by paths in the same directory
+    parents = {}
+    for path in command.operands:
+        # If invalid characters are passed
+        if not isValidPath(path):
+            manager.err(CommandError("rmdir", Error.INVALID_SYNTAX))
+            continue
+        dir = checkOperand(manager, path, parents)
+        # If directory does not exist
+        if not dir:
+            manager.err(CommandError("rmdir", Error.NO_SUCH_FILE_OR_DIRECTORY))
+            continue
+        # If path exists but is not a directory
+        if not isinstance(dir, Directory):
+            manager.err(CommandError("rmdir", Error.NOT_A_DIRECTORY))
+            continue
+        # If directory is not empty
+        if dir.contents:
+            manager.err(CommandError("rmdir", Error.DIRECTORY_NOT_EMPTY))
+            continue
+        # If directory is the working directory, here or in another session
+        if manager.in_use(dir):
+            manager.err(CommandError("rmdir", Error.CANNOT_REMOVE_PWD))
+            continue
+
+        # Permission "x" on directory ancestors and "w" on directory parent
+        if not (manager.can_traverse(dir.parent) and checkPerm(manager, dir.parent, "w")):
+            manager.err(CommandError("rmdir", Error.PERMISSION_DENIED))
+            continue
+
+        # Removing the directory, which paths already looked up may have gone through
+        manager.unlink(dir)
+        parents.clear()
+
 # chmod
-def chmod(manager: Manager, *args):
-    # If incorrect number of parameters are passed
-    if len(args) == 0:
-        print("chmod: Invalid syntax")
-        return
-    elif len(args[0]) < 2 or len(args[0]) > 3:
-        print("chmod: Invalid syntax")
-        return
-    
-    inputs = args[0]
-    if len(inputs) == 2:
-        recursive = False
-        mode = inputs[0]
-        path = inputs[1]
-    if len(inputs) == 3 and inputs[0] == "-r":
-        recursive = True
-        mode = inputs[1]
-        path = inputs[2]
-    
-    destination = checkPath(manager, path)
+def chmod(manager: Manager, command: Command):
+    recursive = command.option == "-r"
+    mode = command.operands[0]
+    paths = command.operands[1:]
 
     # If mode is invalid
-    count = mode.count("-") + mode.count("+") + mode.count("=")
-    if count != 1:
-        print("chmod: Invalid mode")
-        return
-    if "-" in mode:
-        operation = "-"
-        modeList = mode.split("-")
-    elif "+" in mode:
-        operation = "+"
-        modeList = mode.split("+")
-    elif "=" in mode:
-        operation = "="
-        modeList = mode.split("=")
-
-    if (modeList[0].count("u") + modeList[0].count("o") + modeList[0].count("a")) != len(modeList[0]):
-        print("chmod: Invalid mode")
-        return
-    elif (modeList[1].count("r") + modeList[1].count("w") + modeList[1].count("x")) != len(modeList[1]):
-        print("chmod: Invalid mode")
+    mode = compileMode(mode)
+    if mode is None:
+        manager.err(CommandError("chmod", Error.INVALID_MODE))
         return
-    
-    toChange = []
-    if "r" in modeList[1]:
-        toChange.append("r")
-    else:
-        toChange.append("-")
-    if "w" in modeList[1]:
-        toChange.append("w")
-    else:
-        toChange.append("-")
-    if "x" in modeList[1]:
-        toChange.append("x")
-    else:
-        toChange.append("-")
 
-    
-    if not recursive:
-        # If file cannot be found
-        if not destination:
-            print("chmod: No such file or directory")
-            return
-        # If user is invalid
-        if destination.owner != manager.user and manager.user != "root":
-            print("chmod: Operation not permitted")
-            return
-        # Getting permission string
-        fileType = destination.perms[0]
-        userPerms = destination.perms[1:4]
-        otherPerms = destination.perms[4:]
-        # Checking execute permission on ancestors
-        ancPath = destination.parent.path
-        if not checkPathPerms(manager, ancPath, "x"):
-            print("chmod: Permission denied")
-            return
-        # Changing the permissions
-        if "u" in modeList[0] or "a" in modeList[0]: # userPerms permissions need to be changed
-            if operation == "-": # Removing perms
-                for value in toChange:
-                    userPerms = userPerms.replace(value, "-")
-            elif operation == "+": # Adding perms
-                if "r" in toChange:
-                    userPerms = "r" + userPerms[1:]
-                if "w" in toChange:
-                    userPerms = userPerms[0] + "w" + userPerms[2]
-                if "x" in toChange:
-                    userPerms = userPerms[:2] + "x"
-            elif operation == "=": # Setting perms
-                if modeList[1] == "":
-                    userPerms = "---"
-                else:
-                    userPerms = ''.join(toChange)
-        if "o" in modeList[0] or "a" in modeList[0]: # otherPerms permissions need to be changed
-            if operation == "-": # Removing perms
-                for value in toChange:
-                    otherPerms = otherPerms.replace(value, "-")
-            elif operation == "+": # Adding perms
-                if "r" in toChange:
-                    otherPerms = "r" + otherPerms[1:]
-                if "w" in toChange:
-                    otherPerms = otherPerms[0] + "w" + otherPerms[2]
-                if "x" in toChange:
-                    otherPerms = otherPerms[:2] + "x"
-            elif operation == "=": # Setting perms
-                if modeList[1] == "":
-                    otherPerms = "---"
-                else:
-                    otherPerms = ''.join(toChange)
-        destination.perms = fileType + userPerms + otherPerms
-    else: # If "-r" is passed
+    # Parent directories found so far, shared by paths in the same directory
+    parents = {}
+    for path in paths:
+        destination = checkOperand(manager, path, parents)
         # If file cannot be found
         if not destination:
-            print("chmod: No such file or directory")
-            return
-        myList = []
-        if isinstance(destination, Directory):
-            myList = listFiles(manager, destination)
-        myList.append(destination)
-        for file in myList:
+            manager.err(CommandError("chmod", Error.NO_SUCH_FILE_OR_DIRECTORY))
+            continue
+
+        if not recursive:
+            files = [(destination, manager.can_traverse(destination.parent))]
+        else: # If "-r" is passed
+            # One pass over the subtree, which knows whether each file's ancestors can be passed through
+            files = walkReachable(manager, destination)
+        for file, reachable in files:
             # If user is invalid
-            if file.owner != manager.user and manager.user != "root":
-                print("chmod: Operation not permitted")
+            if file.owner != manager.user_id and not manager.is_root:
+                manager.err(CommandError("chmod", Error.OPERATION_NOT_PERMITTED))
                 continue
             # Checking execute permission on ancestors
-            ancPath = file.parent.path
-            if not checkPathPerms(manager, ancPath, "x"):
-                print("chmod: Permission denied")
+            if not reachable:
+                manager.err(CommandError("chmod", Error.PERMISSION_DENIED))
                 continue
-            # Getting permission string for file
-            fileType = file.perms[0]
-            userPerms = file.perms[1:4]
-            otherPerms = file.perms[4:]
-
             # Changing the permissions
-            if "u" in modeList[0] or "a" in modeList[0]: # userPerms permissions need to be changed
-                if operation == "-": # Removing perms
-                    for value in toChange:
-                        userPerms = userPerms.replace(value, "-")
-                elif operation == "+": # Adding perms
-                    if "r" in toChange:
-                        userPerms = "r" + userPerms[1:]
-                    if "w" in toChange:
-                        userPerms = userPerms[0] + "w" + userPerms[2]
-                    if "x" in toChange:
-                        userPerms = userPerms[:2] + "x"
-                elif operation == "=": # Setting perms
-                    if modeList[1] == "":
-                        userPerms = "---"
-                    else:
-                        userPerms = ''.join(toChange)
-            if "o" in modeList[0] or "a" in modeList[0]: # otherPerms permissions need to be changed
-                if operation == "-": # Removing perms
-                    for value in toChange:
-                        otherPerms = otherPerms.replace(value, "-")
-                elif operation == "+": # Adding perms
-                    if "r" in toChange:
-                        otherPerms = "r" + otherPerms[1:]
-                    if "w" in toChange:
-                        otherPerms = otherPerms[0] + "w" + otherPerms[2]
-                    if "x" in toChange:
-                        otherPerms = otherPerms[:2] + "x"
-                elif operation == "=": # Setting perms
-                    if modeList[1] == "":
-                        otherPerms = "---"
-                    else:
-                        otherPerms = ''.join(toChange)
-            file.perms = fileType + userPerms + otherPerms
-
+            manager.set_perms(file, mode.apply(file.perms))
         
 # chown
-def chown(manager: Manager, *args):
-    # If current user is not root
-    if manager.user != "root":
-        print("chown: Operation not permitted")
-        return
-    # If incorrect number of parameters are passed
-    if len(args) == 0:
-        print("chmod: Invalid syntax")
-        return
-    elif len(args[0]) < 2 or len(args[0]) > 3:
-        print("chmod: Invalid syntax")
-        return
-    
-    inputs = args[0]
-    if len(inputs) == 2:
-        recursive = False
-        user = inputs[0]
-        path = inputs[1]
-    if len(inputs) == 3 and inputs[0] == "-r":
-        recursive = True
-        user = inputs[1]
-        path = inputs[2]
+def chown(manager: Manager, command: Command):
+    recursive = command.option == "-r"
+    user = command.operands[0]
+    paths = command.operands[1:]
     
     # If user is invalid
     if user not in manager.users:
-        print("chown: Invalid user")
+        manager.err(CommandError("chown", Error.INVALID_USER))
         return
 
-    destination = checkPath(manager, path)
-    # If file cannot be found
-    if not destination:
-        print("chown: No such file or directory")
-        return
-    
-    if not recursive:
-        destination.owner = user
-    else: # If "-r" is passed
-        if isinstance(destination, Directory):
-            myList = listFiles(manager, destination)
-            myList.append(destination)
-            for file in myList:
-                file.owner = user
+    owner = manager.users[user]
+    # Parent directories found so far, shared by paths in the same directory
+    parents = {}
+    for path in paths:
+        destination = checkOperand(manager, path, parents)
+        # If file cannot be found
+        if not destination:
+            manager.err(CommandError("chown", Error.NO_SUCH_FILE_OR_DIRECTORY))
+            continue
+
+        if recursive and isinstance(destination, Directory): # If "-r" is passed
+            for file in itertools.chain(walkFiles(manager, destination), [destination]):
+                manager.set_owner(file, owner)
         else:
-            destination.owner = user
+            manager.set_owner(destination, owner)
 
 # adduser
-def adduser(manager: Manager, *args):
-    # If current user is not root
-    if manager.user != "root":
-        print("adduser: Operation not permitted")
-        return
-    # If incorrect number of arguments is passed
-    if len(args) == 0:
-        print("adduser: Invalid syntax")
-        return
-    elif len(args[0]) > 1:
-        print("adduser: Invalid syntax")
-        return
-    
-    inputs = args[0]
-    user = inputs[0]
-    # If user already exists
-    for value in manager.users:
-        if value == user:
-            print("adduser: The user already exists")
-            return
-    
-    # Adding the user
-    manager.users.append(user)
+def adduser(manager: Manager, command: Command):
+    user = command.operands[0]
+    # Adding the user, unless they already exist
+    manager.add_user(user)
 
 # deluser
-def deluser(manager: Manager, *args):
-    # If current user is not root
-    if manager.user != "root":
-        print("deluser: Operation not permitted")
-        return
-    # If incorrect number of arguments is passed
-    if len(args) == 0:
-        print("adduser: Invalid syntax")
-        return
-    elif len(args[0]) > 1:
-        print("adduser: Invalid syntax")
-        return
-    
-    inputs = args[0]
-    user = inputs[0]
+def deluser(manager: Manager, command: Command):
+    report = command.option == "--report"
+    reassign = command.values[0] if command.option == "--reassign" else None
+    user = command.operands[0]
 
     # If user does not exist
-    exists = False
-    for value in manager.users:
-        if value == user:
-            exists = True
-    if not exists:
-        print("deluser: The user does not exist")
+    if user not in manager.users:
+        manager.err(CommandError("deluser", Error.USER_DOES_NOT_EXIST))
         return
     
     # If given user is root
     if user == "root":
-        print("""WARNING: You are just about to delete the root account
-Usually this is never required as it may render the whole system unusable
-If you really want this, call deluser with parameter --force
-(but this `deluser` does not allow `--force`, haha)
-Stopping now without having performed any action""")
+        manager.err(CommandError(None, Error.DELETING_ROOT))
+        return
+    # The new owner has to be someone else who still exists
+    if reassign is not None and (reassign == user or reassign not in manager.users):
+        manager.err(CommandError("deluser", Error.INVALID_USER))
         return
     
     # Deleting the given user
-    manager.users.remove(user)
+    uid = manager.remove_user(user)
+    # Whatever they still own is left behind, so it's listed or handed over
+    if report:
+        for path in sortedPaths(manager.owned_by(uid)):
+            manager.out(path)
+    elif reassign is not None:
+        owner = manager.users[reassign]
+        for node in list(manager.owned_by(uid)):
+            manager.set_owner(node, owner)
     
 # su
-def su(manager: Manager, *args):
+def su(manager: Manager, command: Command):
     # If no arguments are passed
-    if len(args) == 0:
-        manager.user = "root"
+    if not command.operands:
+        manager.set_user("root")
         return
-    elif len(args[0]) > 1: # If incorrect number of arguments are passed
-        print("su: Invalid syntax")
-        return
-    
-    inputs = args[0]
-    user = inputs[0]
-    
-    for value in manager.users:
-        if value == user:
-            manager.user = user
-            return
+    user = command.operands[0]
     
     # If user does not exist
-    print("su: Invalid user")
+    if user not in manager.users:
+        manager.err(CommandError("su", Error.INVALID_USER))
+        return
+    manager.set_user(user)
+
+# owned
+def owned(manager: Manager, command: Command):
+    # With no user, how much every user owns
+    if not command.operands:
+        for user, uid in manager.users.items():
+            manager.out(f"{len(manager.owned_by(uid))} {user}")
+        return
+    listing = command.option == "-l"
+    user = command.operands[0]
+    # If user is invalid
+    if user not in manager.users:
+        manager.err(CommandError("owned", Error.INVALID_USER))
+        return
+
+    nodes = manager.owned_by(manager.users[user])
+    if not listing:
+        manager.out(f"{len(nodes)} {user}")
+        return
+    # Only root can see where someone else's files are
+    if manager.user != "root" and manager.user != user:
+        manager.err(CommandError("owned", Error.OPERATION_NOT_PERMITTED))
+        return
+    for path in sortedPaths(nodes):
+        manager.out(path)
 
 # ls
-def ls(manager: Manager, *args):
-    path = ""
-    flags = []
-    # If no arguments are passed to ls
-    if len(args) == 0:
-        lsDir = manager.working_directory
-    else:
-        inputs = args[0]
-        if (inputs[-1] != "-a" and inputs[-1] != "-d" and inputs[-1] != "-l"):
-            path = inputs.pop(-1)
-            flags = inputs
-            lsDir = checkPath(manager, path)
-        else:
-            flags = inputs
-            lsDir = manager.working_directory
-        
-        if not lsDir:
-            print("ls: No such file or directory")
-            return
+def ls(manager: Manager, command: Command):
+    # With more than one path, each directory's listing comes under its path
+    for path in command.operands or [""]:
+        lsPath(manager, command.switches, path, len(command.operands) > 1)
+
+def lsPath(manager: Manager, flags: frozenset, path: str, header: bool):
+    lsDir = checkPath(manager, path) if path else manager.working_directory
+    if not lsDir:
+        manager.err(CommandError("ls", Error.NO_SUCH_FILE_OR_DIRECTORY))
+        return
 
     if isinstance(lsDir, File):
         # Checking "r" permission for lsDir
         if not checkPerm(manager, lsDir.parent, "r"):
-            print("ls: Permission denied")
+            manager.err(CommandError("ls", Error.PERMISSION_DENIED))
             return
         # Checking "x" permission for lsDir's ancestors
-        if not checkPathPerms(manager, lsDir.parent.path, "x"):
-            print("ls: Permission denied")
+        if not manager.can_traverse(lsDir.parent):
+            manager.err(CommandError("ls", Error.PERMISSION_DENIED))
             return
         arr = path.split("/")
         if path == "/":
             arr = ["/"]
         if lsDir.name[0] != "." and "." not in arr and ".." not in arr:
             if "-l" in flags:
-                print(f"{lsDir.perms} {lsDir.owner} {path}")
+                manager.out(f"{PERMS_STRINGS[lsDir.perms]} {manager.owner_name(lsDir)} {path}")
                 return
             else:
-                print(path)
+                manager.out(path)
                 return
         elif "-a" in flags:
             if "-l" in flags:
-                print(f"{lsDir.perms} {lsDir.owner} {path}")
+                manager.out(f"{PERMS_STRINGS[lsDir.perms]} {manager.owner_name(lsDir)} {path}")
                 return
             else:
-                print(path)
+                manager.out(path)
                 return
         return
     
     # Checking "r" permission for lsDir
     if not checkPerm(manager, lsDir, "r"):
-        print("ls: Permission denied")
+        manager.err(CommandError("ls", Error.PERMISSION_DENIED))
         return
+    if header and "-d" not in flags:
+        manager.out(f"{path}:")
 
     if not flags: # If there are no flags
-        lsDir.contents.sort(key=lambda x: x.name)
         for thing in lsDir.contents:
             if thing.name[0] != ".":
-                print(thing.name, end="\n")
+                manager.out(thing.name)
         return
     if "-l" in flags and "-d" not in flags:
         if "-a" in flags:
-            print(f"{lsDir.perms} {lsDir.owner} .")
-            print(f"{lsDir.parent.perms} {lsDir.parent.owner} ..")
-            lsDir.contents.sort(key=lambda x: x.name)
+            manager.out(f"{PERMS_STRINGS[lsDir.perms]} {manager.owner_name(lsDir)} .")
+            manager.out(f"{PERMS_STRINGS[lsDir.parent.perms]} {manager.owner_name(lsDir.parent)} ..")
             for thing in lsDir.contents:
-                print(f"{thing.perms} {thing.owner} {thing.name}", end="\n")
+                manager.out(f"{PERMS_STRINGS[thing.perms]} {manager.owner_name(thing)} {thing.name}")
         else:
-            lsDir.contents.sort(key=lambda x: x.name)
             for thing in lsDir.contents:
                 if thing.name[0] != ".":
-                    print(f"{thing.perms} {thing.owner} {thing.name}", end="\n")
+                    manager.out(f"{PERMS_STRINGS[thing.perms]} {manager.owner_name(thing)} {thing.name}")
     if "-a" in flags and "-l" not in flags and "-d" not in flags:
-        print(".")
-        print("..")
-        lsDir.contents.sort(key=lambda x: x.name)
+        manager.out(".")
+        manager.out("..")
         for thing in lsDir.contents:
-            print(thing.name, end="\n")
+            manager.out(thing.name)
         return
     if "-d" in flags:
         # Checking "r" permission for lsDir parent
         if not checkPerm(manager, lsDir.parent, "r"):
-            print("ls: Permission denied")
+            manager.err(CommandError("ls", Error.PERMISSION_DENIED))
             return
         # Checking "x" permission for lsDir ancestors
-        if not checkPathPerms(manager,lsDir.parent.path, "x"):
-            print("ls: Permission denied")
+        if not manager.can_traverse(lsDir.parent):
+            manager.err(CommandError("ls", Error.PERMISSION_DENIED))
             return
         if path != "":
             if path != "/":
@@ -1062,208 +1962,1320 @@ def ls(manager: Manager, *args):
                 arr = ["/"]
             if "-a" in flags:
                 if "-l" in flags:
-                    print(f"{lsDir.perms} {lsDir.owner} {path}")
+                    manager.out(f"{PERMS_STRINGS[lsDir.perms]} {manager.owner_name(lsDir)} {path}")
                 else:
-                    print(path)
+                    manager.out(path)
             elif ("." not in arr and ".." not in arr) or path[0] == "/":
                 if "-l" in flags:
                     if (not arr[-1][0] == ".") or (arr[-1] == "." and len(arr) > 1):
-                        print(f"{lsDir.perms} {lsDir.owner} {path}")
+                        manager.out(f"{PERMS_STRINGS[lsDir.perms]} {manager.owner_name(lsDir)} {path}")
                 else:
                     if (not arr[-1][0] == ".") or (arr[-1] == "." and len(arr) > 1):
-                        print(path)
+                        manager.out(path)
         else:
             if "-a" in flags and "-l" in flags:
-                print(f"{lsDir.perms} {lsDir.owner} .")
+                manager.out(f"{PERMS_STRINGS[lsDir.perms]} {manager.owner_name(lsDir)} .")
             elif "-a" in flags:
-                print(".")
+                manager.out(".")
+
+# find
+# Checks for the values of find's options
+def isPermMask(value: str) -> bool:
+    return len(value) == 6 and all(c in ("-", p) for c, p in zip(value, "rwxrwx"))
+
+def isNodeType(value: str) -> bool:
+    return value in ("f", "d")
+
+def find(manager: Manager, command: Command):
+    path = command.operands[0]
+    if len(path) > 1 and path[-1] == "/": # Trimming the last slash (if there is one)
+        path = path[:-1]
+    settings = command.settings
+    name = settings.get("-name")
+    owner = perms = kind = maxdepth = None
+    if "-owner" in settings:
+        # If user is invalid
+        if settings["-owner"] not in manager.users:
+            manager.err(CommandError("find", Error.INVALID_USER))
+            return
+        owner = manager.users[settings["-owner"]]
+    if "-perm" in settings:
+        perms = encodePerms("-" + settings["-perm"])
+    if "-type" in settings:
+        kind = Directory if settings["-type"] == "d" else File
+    if "-maxdepth" in settings:
+        maxdepth = int(settings["-maxdepth"])
+    # Tests are run cheapest first, so most nodes are turned down before their name is matched
+    tests = []
+    if kind is not None:
+        tests.append(lambda node: isinstance(node, kind))
+    if owner is not None:
+        tests.append(lambda node: node.owner == owner)
+    if perms is not None:
+        tests.append(lambda node: node.perms & 0x3f == perms)
+    if name is not None:
+        tests.append(lambda node: fnmatchcase(node.name, name))
+
+    start = checkPath(manager, path)
+    if not start:
+        manager.err(CommandError("find", Error.NO_SUCH_FILE_OR_DIRECTORY))
+        return
+    # As with ls, a file needs "r" on its directory and "x" on the way there
+    if isinstance(start, File) and not (checkPerm(manager, start.parent, "r") and manager.can_traverse(start.parent)):
+        manager.err(CommandError("find", Error.PERMISSION_DENIED))
+        return
+
+    # root can list everything, so -owner only needs to look at what the owner has, not the whole walk
+    if owner is not None and manager.is_root and isinstance(start, Directory):
+        matches = []
+        for node in manager.owned_by(owner):
+            names = []
+            above = node
+            while above != start and above != manager.root:
+                names.append(above.name)
+                above = above.parent
+            if above == start and (maxdepth is None or len(names) <= maxdepth) and all(test(node) for test in tests):
+                names.reverse()
+                matches.append(names)
+        # Sorting by name at each level gives the order of the walk
+        for names in sorted(matches):
+            manager.out(joinPath(path, "/".join(names)) if names else path)
+        return
+
+    # Printing each match as soon as the walk gets to it
+    for node, nodePath, depth in walkPaths(manager, start, path, maxdepth):
+        if all(test(node) for test in tests):
+            manager.out(nodePath)
+        # Directories that can't be listed are reported and left out
+        if isinstance(node, Directory) and depth != maxdepth and not canList(manager, node):
+            manager.err(CommandError("find", Error.PERMISSION_DENIED))
+
+# save
+def save(manager: Manager, command: Command):
+    # It would write out changes the transaction may still roll back
+    if manager.in_transaction:
+        manager.err(CommandError("save", Error.TRANSACTION_IN_PROGRESS))
+        return
+    try:
+        saveSnapshot(manager, command.operands[0])
+    except OSError:
+        manager.err(CommandError("save", Error.CANNOT_WRITE_FILE))
+
+# load
+def load(manager: Manager, command: Command):
+    # Its changes couldn't be undone with the rest of the transaction
+    if manager.in_transaction:
+        manager.err(CommandError("load", Error.TRANSACTION_IN_PROGRESS))
+        return
+    try:
+        loadSnapshot(manager, command.operands[0])
+    except OSError:
+        manager.err(CommandError("load", Error.NO_SUCH_FILE))
+        return
+    except ValueError:
+        manager.err(CommandError("load", Error.INVALID_SNAPSHOT))
+        return
+    # The journal can't be replayed on top of the loaded namespace, so it starts over from it
+    if manager.journal is not None:
+        compactJournal(manager)
+
+# snapshot (undo-log snapshots, see Manager.keep_version)
+def snapshot(manager: Manager, command: Command):
+    # With no name, the versions kept and how many changes were made since each
+    if not command.operands:
+        for name, kept in sorted(manager.versions.items(), key=lambda version: version[1]):
+            if name is not None:
+                manager.out(f"{name} {len(manager.undo_log) - kept}")
+        return
+    name = command.operands[0]
+    if command.option == "-d":
+        if name not in manager.versions:
+            manager.err(CommandError("snapshot", Error.NO_SUCH_SNAPSHOT))
+            return
+        manager.drop_version(name)
+        return
+    manager.keep_version(name)
+
+# rollback
+def rollback(manager: Manager, command: Command):
+    # With no name, the open transaction
+    if not command.operands:
+        if not manager.in_transaction:
+            manager.err(CommandError("rollback", Error.NO_TRANSACTION))
+            return
+        manager.rollback_transaction()
+        return
+    # Going back to a snapshot undoes everyone's changes, not only the user's own
+    if not manager.is_root:
+        manager.err(CommandError("rollback", Error.OPERATION_NOT_PERMITTED))
+        return
+    name = command.operands[0]
+    if name not in manager.versions:
+        manager.err(CommandError("rollback", Error.NO_SUCH_SNAPSHOT))
+        return
+    manager.rollback_to(name)
+
+# begin
+def begin(manager: Manager, command: Command):
+    if manager.in_transaction:
+        manager.err(CommandError("begin", Error.TRANSACTION_IN_PROGRESS))
+        return
+    manager.start_transaction()
+
+# commit
+def commit(manager: Manager, command: Command):
+    if not manager.in_transaction:
+        manager.err(CommandError("commit", Error.NO_TRANSACTION))
+        return
+    aborted = manager.aborted
+    manager.commit_transaction()
+    # Its changes were already undone when one of them failed
+    if aborted:
+        manager.err(CommandError("commit", Error.TRANSACTION_ABORTED))
+
+# Commands that start or end a transaction instead of being part of one
+TRANSACTION_COMMANDS = {"begin", "commit", "rollback"}
+
+COMMANDS = {"exit": Syntax(exit),
+            "pwd": Syntax(pwd),
+            "cd": Syntax(cd, least=1, most=1),
+            "mkdir": Syntax(mkdir, flags={"-p": 0}, least=1, most=None),
+            "touch": Syntax(touch, least=1, most=None),
+            "cp": Syntax(cp, least=2, most=2, paths=True),
+            "mv": Syntax(mv, least=2, most=2, paths=True),
+            "rm": Syntax(rm, least=1, most=None),
+            "rmdir": Syntax(rmdir, least=1, most=None),
+            "chmod": Syntax(chmod, flags={"-r": 0}, least=2, most=None),
+            "chown": Syntax(chown, root=True, flags={"-r": 0}, least=2, most=None, alias="chmod"),
+            "adduser": Syntax(adduser, root=True, least=1, most=1),
+            "deluser": Syntax(deluser, root=True, flags={"--report": 0, "--reassign": 1}, least=1, most=1, alias="adduser"),
+            "su": Syntax(su, most=1),
+            "ls": Syntax(ls, most=None, switches={"-a", "-d", "-l"}),
+            "find": Syntax(find, least=1, most=1, options={"-name": None, "-owner": None, "-perm": isPermMask,
+                                                           "-type": isNodeType, "-maxdepth": str.isdigit}),
+            "owned": Syntax(owned, flags={"-l": 0}, most=1),
+            "save": Syntax(save, root=True, least=1, most=1),
+            "load": Syntax(load, root=True, least=1, most=1),
+            "snapshot": Syntax(snapshot, root=True, flags={"-d": 0}, most=1),
+            "rollback": Syntax(rollback, most=1),
+            "begin": Syntax(begin),
+            "commit": Syntax(commit)}
+
+# The library API: a method on Manager for every command, so manager.ls("-l", "/home") runs ls
+# and returns its Result
+def commandMethod(name: str):
+    def method(self, *words) -> Result:
+        return self.call(name, *words)
+    method.__name__ = method.__qualname__ = name
+    return method
+
+def addCommandMethods(commands: dict):
+    for name in commands:
+        setattr(Manager, name, commandMethod(name))
+
+addCommandMethods(COMMANDS)
 
 ## AUXILIARY FUNCTIONS
 
 def checkPerm(manager: Manager, dir: Directory or File, perm: str) -> bool:
-    # root user bypasses all permissions
-    if manager.user == "root":
-        return True
-    # storing the relevant permissions based on current user
-    if manager.user == dir.owner:
-        perms = dir.perms[1:4]
-    else:
-        perms = dir.perms[4:]
-    
-    if(perm == "r" and perms[0] == "r"):
-        return True
-    elif(perm == "w" and perms[1] == "w"):
-        return True
-    elif(perm == "x" and perms[2] == "x"):
-        return True
-    else:
-        return False
+    # root user bypasses all permissions, see Manager.effective
+    return manager.effective(dir) & PERM_BITS[perm] != 0
+
+# Whether a node is still in the tree, rather than in (or under) something that was removed
+def isAttached(manager: Manager, node) -> bool:
+    root = manager.root
+    while node != root:
+        parent = node.parent
+        if not any(child == node for child in parent.scan(node.name)):
+            return False
+        node = parent
+    return True
+
+# Paths of the given nodes in the order a walk from the root would reach them
+def sortedPaths(nodes) -> list:
+    return ["/" + "/".join(names) for names in sorted(node.path.split("/")[1:] for node in nodes)]
+
+# Whether the current user can list what's in a directory: "r" on it and "x" on the way into it
+def canList(manager: Manager, dir: Directory) -> bool:
+    return manager.can_traverse(dir) and checkPerm(manager, dir, "r")
 
 def checkPathPerms(manager: Manager, path: str, perm: str) -> bool or File or Directory:
-    absolute = False
-    if path[0] == "/":
-        absolute = True
-    arr = path.split("/")
-    if path == "/":
-        if checkPerm(manager, manager.root, perm):
-            return manager.root
-        else:
+    node, chain = resolvePath(manager, path)
+    if not node:
+        return False
+    # Every named component of the path needs the permission
+    for thing in chain:
+        if not checkPerm(manager, thing, perm):
             return False
-    if not absolute:
-        current = manager.working_directory
-        i = 0
-        while i < len(arr):
-            if arr[i] == ".":
-                if i == len(arr) - 1:
-                    return current
-                else:
-                    i += 1
-                    continue
-            elif arr[i] == "..":
-                if i == len(arr) - 1:
-                    return current.parent
-                else:
-                    current = current.parent
-                    i += 1
-                    continue
-            if isinstance(current, File):
-                return False
-            for thing in current.contents:
-                if thing.name == arr[i]:
-                    if checkPerm(manager, thing, perm):
-                        temp = thing
-                    else:
-                        return False
-            
-            if i == len(arr) - 1:
-                return temp # Means we're at end of path, so return the file or directory
-            current = temp # Otherwise continue with checking
-            i += 1
-    else:
-        current = manager.root
-        i = 1
-        while i < len(arr):
-            if arr[i] == ".":
-                if i == len(arr) - 1:
-                    return current
-                else:
-                    i += 1
-                    continue
-            elif arr[i] == "..":
-                if i == len(arr) - 1:
-                    return current.parent
-                else:
-                    current = current.parent
-                    i += 1
-                    continue
-            if isinstance(current, File):
-                return False
-            for thing in current.contents:
-                if thing.name == arr[i]:
-                    if checkPerm(manager, thing, perm):
-                        temp = thing
-                    else:
-                        return False # Ancestor doesn't have needed permission
-            
-            if i == len(arr) - 1:
-                return temp # Means we're at end of path, so return the file or directory
-            current = temp # Otherwise continue with checking
-            i += 1
+    return node
 
 def checkPath(manager: Manager, path: str) -> bool or File or Directory:
-    absolute = False
-    if path[0] == "/":
-        absolute = True
-    arr = path.split("/")
+    return resolvePath(manager, path)[0]
+
+# checkPath for a parent directory named by an operand of a multi-operand command. parents holds
+# the directories found so far by that command, so operands in the same directory only look it
+# up once. Only directories that exist are kept, as a later operand may create a missing one.
+def checkParent(manager: Manager, path: str, parents: dict) -> bool or File or Directory:
+    parent = parents.get(path)
+    if parent is None:
+        parent = checkPath(manager, path)
+        if isinstance(parent, Directory):
+            parents[path] = parent
+    return parent
+
+# checkPath for an operand of a multi-operand command, going through its parent (see checkParent)
+def checkOperand(manager: Manager, path: str, parents: dict) -> bool or File or Directory:
+    head, slash, name = path.rpartition("/")
+    if not slash or name in ("", ".", "..") or head.endswith("/"):
+        return checkPath(manager, path)
+    parent = checkParent(manager, head or "/", parents)
+    if not isinstance(parent, Directory):
+        return False
+    return parent.get(name) or False
+
+# Walks a path from the root or working directory.
+# Returns the node (False if it doesn't exist) and the chain of nodes named along the way
+def resolvePath(manager: Manager, path: str) -> tuple:
+    absolute = path[:1] == "/"
+    key = path if absolute else (manager.working_directory, path)
+    entry = manager.path_cache.get(key)
+    if entry is not None:
+        return entry[0], entry[1]
+
     if path == "/":
-        return manager.root
-    if not absolute:
+        entry = (manager.root, (manager.root,), (manager.root,))
+        manager.path_cache.put(key, entry)
+        return entry[0], entry[1]
+    arr = path.split("/")
+    if absolute:
+        current = manager.root
+        arr.pop(0) # arr[0] will be ""
+    else:
         current = manager.working_directory
-        i = 0
-        while i < len(arr):
-            if arr[i] == ".":
-                if i == len(arr) - 1:
-                    return current
-                else:
-                    i += 1
-                    continue
-            elif arr[i] == "..":
-                if i == len(arr) - 1:
-                    return current.parent
-                else:
-                    current = current.parent
-                    i += 1
-                    continue
-            # check if current path part is in working directory
-            exists = False
-            if isinstance(current, File):
-                return False
-            for thing in current.contents:
-                if thing.name == arr[i]:
-                    exists = True
-                    temp = thing
+    chain = []
+    dependencies = [current]
+    node = current
+    for part in arr:
+        if part == ".":
+            continue
+        elif part == "..":
+            current = current.parent
+            dependencies.append(current)
+            node = current
+            continue
+        if isinstance(current, File):
+            node = False
+            break
+        dependencies.append((current, part))
+        thing = current.get(part)
+        if not thing:
+            node = False
+            break
+        chain.append(thing)
+        dependencies.append(thing)
+        current = node = thing
+
+    entry = (node, tuple(chain), tuple(dependencies))
+    manager.path_cache.put(key, entry)
+    return entry[0], entry[1]
             
-            if not exists:
-                return False
+VALID_PATH = re.compile(r"[\w .\-/]*")
+# Whether every name in a path is made of letters, digits, " ", "-", "." and "_"
+def isValidPath(path: str) -> bool:
+    return VALID_PATH.fullmatch(path) is not None
+    
+# Yields everything below dir in pre-order, keeping a stack of iterators rather than recursing
+def walkFiles(manager: Manager, dir: Directory):
+    stack = [iter(dir.contents)]
+    while stack:
+        for file in stack[-1]:
+            yield file
+            if isinstance(file, Directory):
+                stack.append(iter(file.contents))
+                break
+        else:
+            stack.pop()
+
+# Yields (node, path, depth) for node and everything below it in pre-order, going no deeper than
+# maxdepth (None for no limit). Directories the current user can't list are yielded but not
+# looked into.
+def walkPaths(manager: Manager, node, path: str, maxdepth: int = None):
+    yield node, path, 0
+    if not isinstance(node, Directory) or maxdepth == 0 or not canList(manager, node):
+        return
+    stack = [(iter(node.contents), path, 1)]
+    while stack:
+        files, path, depth = stack[-1]
+        for file in files:
+            filePath = joinPath(path, file.name)
+            yield file, filePath, depth
+            if isinstance(file, Directory) and depth != maxdepth and canList(manager, file):
+                stack.append((iter(file.contents), filePath, depth + 1))
+                break
+        else:
+            stack.pop()
+
+# Yields everything below node in pre-order, then node itself, each with whether the current user
+# can pass through every directory above it (what manager.can_traverse(file.parent) would say).
+# That is carried down the walk rather than worked out per file, and it is read off each directory
+# only after the caller is done with it, so a chmod of the directory counts for what is below it.
+def walkReachable(manager: Manager, node):
+    if isinstance(node, Directory):
+        if node == manager.root:
+            above = True # the root itself is never named in a path below it
+        else:
+            above = manager.can_traverse(node)
+        stack = [(iter(node.contents), above, manager.can_traverse(node))]
+        while stack:
+            files, above, reachable = stack[-1]
+            for file in files:
+                yield file, reachable
+                if isinstance(file, Directory):
+                    # Once a directory can't be passed through, nothing below it needs checking
+                    inner = above and manager.effective(file) & 0x1 != 0
+                    stack.append((iter(file.contents), inner, inner))
+                    break
             else:
-                if i == len(arr) - 1:
-                    return temp # Means the path exists
-                current = temp # Otherwise continue with checking
-                i += 1
-    # If path is absolute
+                stack.pop()
+    yield node, manager.can_traverse(node.parent)
+
+## PATTERNS
+#
+# Words with "*", "?" or "[...]" in them are expanded against the tree before the command gets
+# them, as in a shell. "*" matches any run of characters in a name, "?" any one character and
+# "[...]" one of a set; none of them match a leading "." unless the pattern gives it. "**" as a
+# whole part of the path matches any number of directories, or everything below when it comes
+# last. A trailing "/" only matches directories. Names can't contain any of these characters,
+# so a word that matches nothing is passed on as it is.
+
+PATTERN_CHARS = "*?["
+# Options whose value is a pattern for the command to match, not a path
+PATTERN_OPTIONS = {"-name"}
+# Commands that take any number of paths read their expanded words one at a time (see Words)
+STREAMED_COMMANDS = {"mkdir", "touch", "rm", "rmdir", "chmod", "chown"}
+
+# The words of a command line, with patterns only expanded as far as the command reads them.
+# Indexing works like a list and a slice with no end is another Words for the rest. Iterating
+# carries on expanding without keeping the words it has given out, so a pattern matching a
+# million paths never becomes a list of them.
+class Words:
+    __slots__ = ("source", "read", "start")
+    # iterator of the expanded words not yet read
+    source: object
+    # words read by index so far, shared with slices
+    read: list
+    # where this Words starts in read
+    start: int
+    def __init__(self, source, read: list = None, start: int = 0):
+        self.source = source
+        self.read = [] if read is None else read
+        self.start = start
+
+    # Reads words until there are n from start on or there are no more, returning how many there are
+    def fill(self, n: int) -> int:
+        read = self.read
+        while len(read) < self.start + n:
+            word = next(self.source, None)
+            if word is None:
+                break
+            read.append(word)
+        return max(len(read) - self.start, 0)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice) and key.stop is None and key.step is None and (key.start or 0) >= 0:
+            return Words(self.source, self.read, self.start + (key.start or 0))
+        if isinstance(key, int) and key >= 0:
+            if self.fill(key + 1) <= key:
+                raise IndexError("Words index out of range")
+            return self.read[self.start + key]
+        self.fill(sys.maxsize)
+        return self.read[self.start:][key]
+
+    def __len__(self) -> int:
+        return self.fill(sys.maxsize)
+
+    def __bool__(self) -> bool:
+        return self.fill(1) > 0
+
+    def __iter__(self):
+        read = self.read
+        i = self.start
+        while i < len(read):
+            yield read[i]
+            i += 1
+        yield from self.source
+
+def isPattern(word: str) -> bool:
+    return any(char in word for char in PATTERN_CHARS)
+
+# The words with their patterns expanded, lazily. The value of an option that takes a pattern
+# itself (find -name) is left alone.
+def expandWords(manager: Manager, words: list) -> Words:
+    return Words(itertools.chain.from_iterable(
+        [word] if previous in PATTERN_OPTIONS else expandWord(manager, word)
+        for previous, word in zip([None] + words, words)))
+
+def expandWord(manager: Manager, word: str):
+    if not isPattern(word):
+        yield word
+        return
+    matched = False
+    for path in expandPattern(manager, word):
+        matched = True
+        yield path
+    if not matched:
+        yield word
+
+# Yields every path matching pattern, in order. The tree is walked one part of the pattern at a
+# time with a stack of generators, so nothing is listed ahead of the command using the paths.
+def expandPattern(manager: Manager, pattern: str):
+    parts = pattern.split("/")
+    if parts[0] == "": # If pattern is absolute
+        parts.pop(0)
+        start = (manager.root, "/", 0)
     else:
-        current = manager.root
-        # arr[0] will be ""
-        i = 1
-        while i < len(arr):
-            if arr[i] == ".":
-                if i == len(arr) - 1:
-                    return current
-                else:
-                    i += 1
-                    continue
-            elif arr[i] == "..":
-                if i == len(arr) - 1:
-                    return current.parent
-                else:
-                    current = current.parent
-                    i += 1
-                    continue
-            # check if current path part is in working directory
-            exists = False
-            if isinstance(current, File):
-                return False
-            for thing in current.contents:
-                if thing.name == arr[i]:
-                    exists = True
-                    temp = thing
-            
-            if not exists:
-                return False
+        start = (manager.working_directory, "", 0)
+    directoriesOnly = len(parts) > 1 and parts[-1] == ""
+    if directoriesOnly:
+        parts.pop()
+    last = len(parts)
+
+    stack = [iter([start])]
+    while stack:
+        for node, path, i in stack[-1]:
+            if i == last:
+                if path and (not directoriesOnly or isinstance(node, Directory)):
+                    yield path
+                continue
+            stack.append(matchPart(manager, node, path, parts[i], i, i + 1 == last))
+            break
+        else:
+            stack.pop()
+
+# Yields (node, path, i + 1) for every child of node matching part i of a pattern.
+# Only directories are looked into unless it's the last part (final).
+def matchPart(manager: Manager, node, path: str, part: str, i: int, final: bool):
+    if not isinstance(node, Directory):
+        return
+    if not isPattern(part):
+        if part == ".":
+            child = node
+        elif part == "..":
+            child = node.parent
+        else:
+            child = node.get(part)
+        if child:
+            yield child, joinPath(path, part), i + 1
+        return
+    if not canList(manager, node):
+        return
+    if part == "**":
+        if not final:
+            yield node, path, i + 1 # no directories at all
+        for child in node.scan():
+            if child.name[:1] == ".":
+                continue
+            childPath = joinPath(path, child.name)
+            if final:
+                yield child, childPath, i + 1
+            if isinstance(child, Directory):
+                yield child, childPath, i # more directories
+        return
+    # Only the children starting with the literal part of the pattern are looked at
+    prefix = part
+    for char in PATTERN_CHARS:
+        prefix = prefix.split(char, 1)[0]
+    hidden = part[:1] == "."
+    for child in node.scan(prefix):
+        name = child.name
+        if (hidden or name[:1] != ".") and (final or isinstance(child, Directory)) and fnmatchcase(name, part):
+            yield child, joinPath(path, name), i + 1
+
+def joinPath(path: str, name: str) -> str:
+    if path == "":
+        return name
+    if path[-1] == "/":
+        return path + name
+    return path + "/" + name
+
+## SNAPSHOTS
+#
+# A snapshot is a version header and the generation of the namespace (see compactJournal),
+# followed by a zlib compressed body:
+#   counts      node, user and owner counts, then the byte length of the three name tables
+#   users       every name in Manager.users, joined by NUL
+#   owners      the name for every user id, joined by NUL
+#   names       the name of every node, joined by NUL
+#   parents     int32 index of the parent of every node (the root is its own parent)
+#   owner ids   int32 user id of the owner of every node
+#   modes       the permission bits of every node
+# Nodes are stored in pre-order, so a parent always comes before its children.
+
+SNAPSHOT_MAGIC = b"NSNP"
+SNAPSHOT_VERSION = 2
+SNAPSHOT_HEADER = struct.Struct("<4sH")
+SNAPSHOT_GENERATION = struct.Struct("<Q")
+SNAPSHOT_COUNTS = struct.Struct("<6I")
+def saveSnapshot(manager: Manager, filename: str):
+    names = []
+    parents = array("i")
+    ownerIds = array("i")
+    modes = bytearray()
+    stack = [(manager.root, 0)]
+    while stack:
+        node, parent = stack.pop()
+        index = len(names)
+        names.append(node.name)
+        parents.append(parent)
+        ownerIds.append(node.owner)
+        modes.append(node.perms)
+        if isinstance(node, Directory):
+            # Pushing in reverse so the children come out in order
+            for child in reversed(node.contents):
+                stack.append((child, index))
+    if sys.byteorder == "big":
+        parents.byteswap()
+        ownerIds.byteswap()
+
+    usersBlob = "\0".join(manager.users).encode()
+    owners = manager.user_names
+    ownersBlob = "\0".join(owners).encode()
+    namesBlob = "\0".join(names).encode()
+    body = b"".join([SNAPSHOT_COUNTS.pack(len(names), len(manager.users), len(owners),
+                                          len(usersBlob), len(ownersBlob), len(namesBlob)),
+                     usersBlob, ownersBlob, namesBlob,
+                     parents.tobytes(), ownerIds.tobytes(), bytes(modes)])
+    # Writing next to the target first so a crash never leaves half a snapshot behind
+    temp = filename + ".tmp"
+    with open(temp, "wb") as snapshot:
+        snapshot.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION))
+        snapshot.write(SNAPSHOT_GENERATION.pack(manager.generation))
+        snapshot.write(zlib.compress(body, 1))
+        snapshot.flush()
+        os.fsync(snapshot.fileno())
+    os.replace(temp, filename)
+
+# Replaces the namespace of the manager with the one in the snapshot.
+# Raises OSError if the file can't be read and ValueError if it isn't a valid snapshot
+def loadSnapshot(manager: Manager, filename: str):
+    with open(filename, "rb") as snapshot:
+        data = snapshot.read()
+    try:
+        magic, version = SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError("unknown snapshot format")
+        generation, = SNAPSHOT_GENERATION.unpack_from(data, SNAPSHOT_HEADER.size)
+        offset = SNAPSHOT_HEADER.size + SNAPSHOT_GENERATION.size
+        body = zlib.decompress(data[offset:])
+        count, userCount, ownerCount, usersLen, ownersLen, namesLen = SNAPSHOT_COUNTS.unpack_from(body)
+        offset = SNAPSHOT_COUNTS.size
+        users = body[offset : offset + usersLen].decode().split("\0")
+        offset += usersLen
+        owners = body[offset : offset + ownersLen].decode().split("\0")
+        offset += ownersLen
+        names = body[offset : offset + namesLen].decode().split("\0")
+        offset += namesLen
+        parents = array("i", body[offset : offset + 4 * count])
+        offset += 4 * count
+        ownerIds = array("i", body[offset : offset + 4 * count])
+        offset += 4 * count
+        modes = body[offset : offset + count]
+    except (struct.error, zlib.error, UnicodeDecodeError) as error:
+        raise ValueError("corrupt snapshot") from error
+    if (len(users) != userCount or len(owners) != ownerCount or len(names) != count
+            or len(modes) != count or count == 0 or not modes[0] & DIRECTORY_BIT):
+        raise ValueError("corrupt snapshot")
+    if sys.byteorder == "big":
+        parents.byteswap()
+        ownerIds.byteswap()
+
+    if len(parents) != count or len(ownerIds) != count or not 0 <= min(ownerIds) <= max(ownerIds) < ownerCount:
+        raise ValueError("corrupt snapshot")
+
+    # Owner ids in the file are mapped onto a fresh table of user names, which only replaces the
+    # manager's once the whole tree is built: until then the live tree's owners still index it
+    userNames = ["root"]
+    userIds = {"root": ROOT_ID}
+    for user in itertools.chain(owners, users):
+        if user not in userIds:
+            userIds[user] = len(userNames)
+            userNames.append(user)
+    owners = [userIds[owner] for owner in owners]
+    users = {user: userIds[user] for user in users}
+    root = manager.root.new_root()
+    root.owner = owners[ownerIds[0]]
+    root.perms = modes[0]
+    nodes = [root]
+    for i in range(1, count):
+        parentIndex = parents[i]
+        if not 0 <= parentIndex < i or not isinstance(nodes[parentIndex], Directory):
+            raise ValueError("corrupt snapshot")
+        parent = nodes[parentIndex]
+        bits = modes[i]
+        if bits & DIRECTORY_BIT:
+            node = parent.new_dir(names[i])
+        else:
+            node = parent.new_file(names[i])
+        node.owner = owners[ownerIds[i]]
+        node.perms = bits
+        nodes.append(node)
+
+    if manager.history is not None:
+        manager.record_tree()
+    manager.root = root
+    manager.working_directory = root
+    manager.user_names = userNames
+    manager.user_ids = userIds
+    manager.users = users
+    manager.generation = generation
+    manager.owner_index = None
+    manager.set_user(manager.user)
+    manager.clear_traverse()
+    manager.path_cache.clear()
+    # Versions kept with the snapshot command can't be rolled back to across a load
+    manager.drop_versions()
+
+## JOURNAL
+#
+# The journal starts with a header holding the generation of the snapshot it applies to,
+# followed by one record per mutating command: the payload length and its CRC-32, then the
+# user, working directory, command and arguments joined by NUL.
+
+JOURNAL_MAGIC = b"NJNL"
+JOURNAL_VERSION = 1
+JOURNAL_HEADER = struct.Struct("<4sHQ")
+JOURNAL_RECORD = struct.Struct("<II")
+JOURNALED_COMMANDS = {"mkdir", "touch", "cp", "mv", "rm", "rmdir", "chmod", "chown", "adduser", "deluser",
+                      "snapshot", "rollback", "begin", "commit"}
+
+def writeJournalHeader(filename: str, generation: int):
+    temp = filename + ".tmp"
+    with open(temp, "wb") as journal:
+        journal.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION, generation))
+        journal.flush()
+        os.fsync(journal.fileno())
+    os.replace(temp, filename)
+
+# Replays the journal on top of the namespace loaded from its snapshot and starts logging to it.
+# A torn record at the end (from a crash mid-write) is cut off.
+def openJournal(manager: Manager, commands: dict, filename: str, snapshot: str,
+                sync_every: int = 1, compact_size: int = 64 << 20) -> Journal:
+    if not os.path.exists(filename):
+        writeJournalHeader(filename, manager.generation)
+    with open(filename, "rb") as journal:
+        data = journal.read()
+    try:
+        magic, version, generation = JOURNAL_HEADER.unpack_from(data)
+    except struct.error:
+        raise ValueError("Invalid journal")
+    if magic != JOURNAL_MAGIC or version != JOURNAL_VERSION:
+        raise ValueError("Invalid journal")
+    if generation > manager.generation:
+        raise ValueError("Journal is newer than its snapshot")
+
+    if generation < manager.generation:
+        # The snapshot was written by a compaction that didn't get to reset the journal
+        writeJournalHeader(filename, manager.generation)
+    else:
+        end = replayJournal(manager, commands, data)
+        if end < len(data):
+            with open(filename, "r+b") as journal:
+                journal.truncate(end)
+                os.fsync(journal.fileno())
+    manager.set_user("root")
+    manager.working_directory = manager.root
+    manager.journal = Journal(filename, snapshot, manager.generation, sync_every, compact_size)
+    # A transaction the last run didn't get to end is undone, and logged as such so it stays that way
+    if manager.in_transaction:
+        runCommand(manager, commands, ["rollback"])
+    return manager.journal
+
+# Runs every intact record with its output discarded, returning where the intact records end
+def replayJournal(manager: Manager, commands: dict, data: bytes) -> int:
+    offset = JOURNAL_HEADER.size
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        while offset + JOURNAL_RECORD.size <= len(data):
+            length, checksum = JOURNAL_RECORD.unpack_from(data, offset)
+            start = offset + JOURNAL_RECORD.size
+            payload = data[start : start + length]
+            if len(payload) != length or zlib.crc32(payload) != checksum:
+                break
+            user, cwd, *inputs = payload.decode().split("\0")
+            manager.set_user(user)
+            directory = checkPath(manager, cwd)
+            manager.working_directory = directory if isinstance(directory, Directory) else manager.root
+            try:
+                runCommand(manager, commands, inputs)
+            except Exception:
+                pass # commands that crashed when they were first run crash the same way now
+            offset = start + length
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return offset
+
+# Folds the journal into a new snapshot and empties it
+def compactJournal(manager: Manager):
+    journal = manager.journal
+    manager.generation = max(manager.generation, journal.generation) + 1
+    saveSnapshot(manager, journal.snapshot)
+    journal.reset(manager.generation)
+
+## CONCURRENCY
+#
+# A SharedManager can be used from many threads at once. Every command takes a readers-writer
+# lock: the ones in WRITING_COMMANDS hold it alone, while the rest only read the tree and run
+# alongside each other. Each thread has its own user, working directory and output, kept in a
+# SessionState, the way every connection to the server has its own Session.
+#
+# So no command sees another's change half applied. The reads that can take long, walking the
+# tree (VERSIONED_COMMANDS), don't take the lock at all: they run on a version of the tree that
+# stays as the last change before them left it (see TREE VERSIONS), and writers don't wait for them.
+
+WRITING_COMMANDS = JOURNALED_COMMANDS | {"save", "load"}
+VERSIONED_COMMANDS = {"ls", "find", "owned"}
+# The commands that change the namespace itself, and so make up a transaction: one of them failing
+# aborts it, and they're refused once it has been
+CHANGING_COMMANDS = JOURNALED_COMMANDS - TRANSACTION_COMMANDS - {"snapshot"}
+
+# Lock held by any number of readers or by one writer. Writers that are waiting keep new readers
+# out, so a steady stream of reads can't hold them off forever
+class ReadWriteLock:
+    condition: threading.Condition
+    # readers holding the lock
+    readers: int
+    # whether a writer holds it
+    writer: bool
+    # id of the thread of the writer holding it, None if there's none
+    holder: int
+    # writers waiting for it
+    waiting: int
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = False
+        self.holder = None
+        self.waiting = 0
+
+    def acquire(self, writing: bool):
+        with self.condition:
+            if writing:
+                self.waiting += 1
+                while self.writer or self.readers:
+                    self.condition.wait()
+                self.waiting -= 1
+                self.writer = True
+                self.holder = threading.get_ident()
             else:
-                if i == len(arr) - 1:
-                    return temp # Means the path exists
-                current = temp # Otherwise continue with checking
-                i += 1
-            
-def isValid(input) -> bool:
-    chars = [" ", "-", ".", "_"]
-    for c in input:
-        if not c.isalnum() and c not in chars:
-            return False
+                while self.writer or self.waiting:
+                    self.condition.wait()
+                self.readers += 1
+
+    def release(self, writing: bool):
+        with self.condition:
+            if writing:
+                self.writer = False
+                self.holder = None
+            else:
+                self.readers -= 1
+            if not self.readers:
+                self.condition.notify_all()
+
+# The part of a SharedManager each thread has to itself, starting out as root in "/". Where the
+# thread is in the tree is kept in a Session, like a client of the server, so rmdir can see it
+class SessionState(threading.local):
+    def __init__(self, manager: Manager):
+        self.place = Session(manager)
+        manager.add_session(self.place)
+        self.out = print
+        self.err = print
+        self.user = "root"
+        self.user_id = ROOT_ID
+        self.is_root = True
+        self.traverse_cache = manager.traverse_caches.setdefault(ROOT_ID, {})
+
+# Manager attribute kept in the SessionState of the calling thread
+def sessionAttribute(name: str) -> property:
+    def get(manager):
+        return getattr(manager.session, name)
+    def put(manager, value):
+        setattr(manager.session, name, value)
+    return property(get, put)
+
+# Path cache readers can share: lookups move entries and add new ones, so they take turns. Entries
+# are only dropped by commands that hold the lock alone
+class SharedPathCache(PathCache):
+    def __init__(self, size: int = 4096):
+        super().__init__(size)
+        self.mutex = threading.Lock()
+
+    def get(self, key):
+        with self.mutex:
+            return super().get(key)
+
+    def put(self, key, entry: tuple):
+        with self.mutex:
+            super().put(key, entry)
+
+# Manager whose commands and methods can be called from many threads at once
+class SharedManager(Manager):
+    session: SessionState
+    user = sessionAttribute("user")
+    user_id = sessionAttribute("user_id")
+    is_root = sessionAttribute("is_root")
+    traverse_cache = sessionAttribute("traverse_cache")
+    out = sessionAttribute("out")
+    err = sessionAttribute("err")
+
+    # Version of the tree last published, and how many reads of each version are going on
+    published: int
+    readers: dict
+    # Whether a writer holds the lock, to publish the next version when it lets go
+    writing: bool
+    # Records Manager.history can grow to before the ones no read needs are dropped
+    history_limit: int
+
+    def __init__(self, root, cache_size: int = 4096, traverse_limit: int = 1 << 18):
+        self.lock = ReadWriteLock()
+        # Taken to start and publish versions and to start and stop reading one
+        self.publishing = threading.Condition(threading.Lock())
+        self.published = 0
+        self.readers = {}
+        self.writing = False
+        self.history_limit = HISTORY_LIMIT
+        # What a SessionState starts from, Manager.__init__ then sets up this thread's own
+        self.root = root
+        self.traverse_caches = {}
+        # Threads add their sessions the first time they use the manager, which can be while
+        # rmdir is looking through them
+        self.sessions_mutex = threading.Lock()
+        self.sessions = weakref.WeakSet()
+        self.session = SessionState(self)
+        super().__init__(root, cache_size, traverse_limit)
+        self.path_cache = SharedPathCache(cache_size)
+        # Manager.__init__ started a new set of sessions, without this thread's
+        self.add_session(self.session.place)
+
+    @property
+    def working_directory(self) -> Directory:
+        return self.session.place.working_directory
+
+    @working_directory.setter
+    def working_directory(self, directory: Directory):
+        self.session.place.working_directory = directory
+
+    def add_session(self, session):
+        with self.sessions_mutex:
+            super().add_session(session)
+
+    def in_use(self, directory: Directory) -> bool:
+        with self.sessions_mutex:
+            return super().in_use(directory)
+
+    # Other threads keep the caches of their users, so they're only emptied
+    def drop_traverse(self):
+        self.clear_traverse()
+
+    # Back to "/" if another thread took this one's working directory out of the tree
+    def follow_tree(self):
+        followTree(self, self.session.place)
+
+    # Takes the lock. A writer then starts on the next version, recording the changes it makes
+    # only if someone is reading an older one
+    def acquire(self, writing: bool):
+        self.lock.acquire(writing)
+        if not writing:
+            return
+        with self.publishing:
+            self.writing = True
+            self.recording = self.published + 1
+            if not self.readers:
+                self.history = self.root_history = None
+            elif self.history is None:
+                self.history, self.root_history = {}, []
+            elif len(self.history) > self.history_limit:
+                self.drop_history(min(self.readers))
+
+    # A transaction holds the lock for as long as its session likes, so its changes are recorded
+    # even if no one was reading when it began: reads that start meanwhile don't wait for it
+    def start_transaction(self):
+        super().start_transaction()
+        with self.publishing:
+            if self.history is None:
+                self.history, self.root_history = {}, []
+                self.publishing.notify_all()
+
+    # Lets go of the lock, publishing the version written first if writing
+    def release(self, writing: bool):
+        if writing:
+            with self.publishing:
+                self.published = self.recording
+                self.writing = False
+                self.publishing.notify_all()
+        self.lock.release(writing)
+
+    # Starts a read of the version last published. A writer that found no one reading when it
+    # started records nothing, so a read waits for it to publish
+    def read_version(self) -> "TreeVersion":
+        with self.publishing:
+            while self.writing and self.history is None:
+                self.publishing.wait()
+            version = self.published
+            self.readers[version] = self.readers.get(version, 0) + 1
+        return TreeVersion(self, version)
+
+    def done_reading(self, tree: "TreeVersion"):
+        with self.publishing:
+            self.readers[tree.version] -= 1
+            if not self.readers[tree.version]:
+                del self.readers[tree.version]
+
+    # Drops the records no read needs: those made by versions up to the oldest one being read.
+    # The dictionaries are replaced rather than changed, as reads may be looking through them
+    def drop_history(self, oldest: int):
+        history = {}
+        for node, entries in self.history.items():
+            entries = [entry for entry in entries if entry[0] > oldest]
+            if entries:
+                history[node] = entries
+        self.history = history
+        self.root_history = [entry for entry in self.root_history if entry[0] > oldest]
+        self.history_limit = max(HISTORY_LIMIT, 2 * len(self.history))
+
+## TREE VERSIONS
+#
+# The reads in VERSIONED_COMMANDS run on a version of a SharedManager's tree instead of taking its
+# lock. Every change (a writing command, or a whole transaction) is published as the next version
+# once it's done, and a read works on the last version published when it started, however long it
+# takes and whatever is changed meanwhile.
+#
+# Nothing is copied up front. While anyone is reading, a writer records what each node is like
+# before it first changes it (a NodeState) in Manager.history, tagged with the version being
+# written. A directory's children are kept by sharing their blocks (see SortedBlocks.share), which
+# are only copied block by block as they're changed. The root and the users are kept in
+# Manager.root_history when load replaces them or a user is added or removed, the users being
+# copied then, once per version. A read sees a node as the first record made after its version
+# says, or as it is now if there's none. It looks at the node first and the records after, and a
+# writer records a node before changing it, so neither has to wait for the other.
+#
+# Records are only made while someone is reading, or a transaction is open: a read that starts
+# while a writer that found no one reading is still going waits for that writer to publish.
+# They're dropped once no read needs them, all at once when no one is reading and in passes every
+# HISTORY_LIMIT records otherwise.
+
+# What a node was like: its name, parent, owner and permissions, and for a directory the blocks
+# its children were in
+NodeState = namedtuple("NodeState", ["name", "parent", "owner", "perms", "blocks"])
+# The state of a node made after the version read
+MISSING = NodeState(None, None, None, None, None)
+HISTORY_LIMIT = 1 << 16
+
+# A version of a SharedManager's tree for one reading command to run on, as a manager of its own
+# with the user, working directory and output of the thread reading it. Its nodes are handles
+# (NodeVersion) on the shared manager's nodes
+class TreeVersion(Manager):
+    # the manager this is a version of, and which version
+    shared: SharedManager
+    version: int
+    # the shared manager's root for the namespace in this version
+    live_root: Directory
+
+    def __init__(self, shared: SharedManager, version: int):
+        self.shared = shared
+        self.version = version
+        root, users, names = shared.root, shared.users, shared.user_names
+        for kept, before in shared.root_history or ():
+            if kept > version:
+                root, users, names = before
+                break
+        self.live_root = root
+        self.root = self.node(root)
+        self.users = users
+        self.user_names = names
+        self.user = shared.user
+        self.user_id = shared.user_id
+        self.is_root = shared.is_root
+        self.path_cache = PathCache(shared.path_cache.size)
+        self.traverse_cache = {}
+        self.traverse_caches = {self.user_id: self.traverse_cache}
+        self.traverse_limit = shared.traverse_limit
+        self.traverse_size = 0
+        self.owner_index = None
+        self.versions = {}
+        self.out = shared.out
+        self.err = shared.err
+        # The thread's working directory, unless it isn't in this version
+        directory = self.node(shared.working_directory)
+        self.working_directory = directory if isAttached(self, directory) else self.root
+
+    def node(self, node):
+        if isinstance(node, Directory):
+            return DirectoryVersion(self, node)
+        return FileVersion(self, node)
+
+    # What a node was like in this version, None if it's still like that
+    def state(self, node) -> NodeState:
+        history = self.shared.history
+        if history is not None:
+            for kept, before in history.get(node, ()):
+                if kept > self.version:
+                    return before
+        return None
+
+    # The nodes the user owned in this version: the ones the shared manager's index has that
+    # haven't changed since, and the changed ones that were the user's then and in the tree.
+    # The index is built under the lock if it isn't yet. This version is walked instead if its
+    # namespace has been replaced by load
+    def owned_by(self, owner: int) -> set:
+        shared = self.shared
+        index = shared.owner_index
+        if self.owner_index is None and index is None and shared.root is self.live_root:
+            shared.lock.acquire(False)
+            try:
+                shared.owned_by(owner)
+            finally:
+                shared.lock.release(False)
+            index = shared.owner_index
+        if self.owner_index is not None or index is None or shared.root is not self.live_root:
+            return Manager.owned_by(self, owner)
+        nodes = {self.node(node) for node in list(index.get(owner, ())) if self.state(node) is None}
+        for node in list(shared.history or ()):
+            before = self.state(node)
+            if before is not None and before is not MISSING and before.owner == owner:
+                version = self.node(node)
+                if isAttached(self, version):
+                    nodes.add(version)
+        return nodes
+
+# Handle on a node of a TreeVersion, reading it as it was in the version
+class NodeVersion():
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return isinstance(other, NodeVersion) and self.node == other.node and self.tree is other.tree
+
+    def __hash__(self):
+        return hash(self.node)
+
+    @property
+    def name(self) -> str:
+        name = self.node.name
+        before = self.tree.state(self.node)
+        return name if before is None else before.name
+
+    @property
+    def parent(self):
+        parent = self.node.parent
+        before = self.tree.state(self.node)
+        return self.tree.node(parent if before is None else before.parent)
+
+    @property
+    def owner(self) -> int:
+        owner = self.node.owner
+        before = self.tree.state(self.node)
+        return owner if before is None else before.owner
+
+    @property
+    def perms(self) -> int:
+        perms = self.node.perms
+        before = self.tree.state(self.node)
+        return perms if before is None else before.perms
+
+    @property
+    def path(self) -> str:
+        root = self.tree.root
+        names = []
+        node = self
+        while node != root:
+            names.append(node.name)
+            node = node.parent
+        return "/" + "/".join(reversed(names))
+
+class FileVersion(NodeVersion, File):
+    __slots__ = ("tree", "node")
+    def __init__(self, tree: TreeVersion, node):
+        self.tree = tree
+        self.node = node
+
+class DirectoryVersion(NodeVersion, Directory):
+    __slots__ = ("tree", "node")
+    def __init__(self, tree: TreeVersion, node):
+        self.tree = tree
+        self.node = node
+
+    # The directory's entries in the version, which nothing changes any more
+    def blocks(self) -> SortedBlocks:
+        node = self.node
+        blocks = node.entries.blocks
+        before = self.tree.state(node)
+        if before is not None:
+            blocks = before.blocks
+        return SortedBlocks(self.entry_name, list, blocks)
+
+    def entry_name(self, entry) -> str:
+        return self.child(entry).name
+
+    def child(self, entry):
+        return self.tree.node(self.node.node_of(entry))
+
+    @property
+    def contents(self):
+        return ContentsVersion(self, self.blocks())
+
+    def get(self, name: str):
+        entries = self.blocks()
+        k, i = entries.after(name)
+        if i == 0:
+            if k == 0:
+                return None
+            k -= 1
+            i = len(entries.blocks[k])
+        child = self.child(entries.blocks[k][i - 1])
+        return child if child.name == name else None
+
+    # As SortedBlocks.scan, but stepping along the blocks as they can't change
+    def scan(self, prefix: str = ""):
+        entries = self.blocks()
+        blocks = entries.blocks
+        k = bisect_left(blocks, prefix, key=entries.last_name)
+        i = bisect_left(blocks[k], prefix, key=self.entry_name) if k < len(blocks) else 0
+        for block in itertools.islice(blocks, k, None):
+            for entry in itertools.islice(block, i, None):
+                child = self.child(entry)
+                if not child.name.startswith(prefix):
+                    return
+                yield child
+            i = 0
+
+# The children of a DirectoryVersion
+class ContentsVersion():
+    __slots__ = ("directory", "entries")
+    def __init__(self, directory: DirectoryVersion, entries: SortedBlocks):
+        self.directory = directory
+        self.entries = entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self):
+        return map(self.directory.child, self.entries)
+
+    def __reversed__(self):
+        return map(self.directory.child, reversed(self.entries))
+
+
+## SERVER
+#
+# With --serve, clients connect over a Unix socket or TCP and each gets a session that works like
+# the shell on standard input: a prompt, then the output of each line it sends, until exit. Every
+# session has its own user and working directory, and all of them share one namespace. Commands
+# run one at a time on the event loop, so each one sees the tree as the last one left it. While a
+# session has a transaction open the others wait, and it's rolled back if the session ends first.
+# Clients aren't asked who they are and every session starts as root, so they're kept away from
+# the host's own files: save and load are refused.
+
+HOST_COMMANDS = {"save", "load"}
+
+# What a client of the server has of its own: who it is and where it is in the tree
+class Session:
+    __slots__ = ("user", "working_directory", "root", "unlinks", "transaction", "__weakref__")
+    def __init__(self, manager: Manager):
+        self.user = "root"
+        self.working_directory = manager.root
+        # The root the working directory belongs to, which load replaces
+        self.root = manager.root
+        # manager.unlinks when the working directory was last known to be in the tree
+        self.unlinks = manager.unlinks
+        # Whether the open transaction is this session's
+        self.transaction = False
+
+# Sends a session back to "/" if its working directory left the tree since its last command: a
+# new namespace was loaded, or a rollback in another session took the directory away
+def followTree(manager: Manager, session: Session):
+    if session.root is not manager.root:
+        session.working_directory = session.root = manager.root
+    elif session.unlinks != manager.unlinks and not isAttached(manager, session.working_directory):
+        session.working_directory = manager.root
+    session.unlinks = manager.unlinks
+
+# Runs one line for a session, with the manager taking on the session's user and working
+# directory while it does and sending what the command prints to write. Returns False after exit
+def runSession(manager: Manager, commands: dict, session: Session, line: str, write) -> bool:
+    try:
+        inputs = splitLine(line)
+    except ValueError: # a quote that isn't closed
+        write(CommandError(line.split()[0], Error.INVALID_SYNTAX))
+        return True
+    if not inputs:
+        return True
+    if inputs[0] in HOST_COMMANDS:
+        write(CommandError(inputs[0], Error.OPERATION_NOT_PERMITTED))
+        return True
+    followTree(manager, session)
+    manager.set_user(session.user)
+    manager.working_directory = session.working_directory
+    manager.out = manager.err = write
+    try:
+        runCommand(manager, commands, inputs)
+    except ExitShell:
+        return False
+    finally:
+        session.user = manager.user
+        session.working_directory = manager.working_directory
+        session.root = manager.root
+        session.transaction = manager.in_transaction
     return True
-    
-def listFiles(manager: Manager, dir: Directory) -> list:
-    output = []
-
-    for file in dir.contents:
-        if isinstance(file, Directory):
-            output.append(file)
-            output += listFiles(manager, file)
-        elif isinstance(file, File):
-            output.append(file)
-    
-    return output
+
+# idle is set while no session has a transaction open
+async def serveClient(manager: Manager, commands: dict, reader, writer, idle: asyncio.Event):
+    session = Session(manager)
+    manager.add_session(session)
+    # Lines a command prints, and the CommandErrors it reports
+    def write(line):
+        writer.write(str(line).encode() + b"\n")
+    try:
+        while True:
+            followTree(manager, session)
+            writer.write(f"{session.user}:{session.working_directory.path}$ ".encode())
+            await writer.drain()
+            line = await reader.readline()
+            while manager.in_transaction and not session.transaction:
+                await idle.wait()
+            if not line or not runSession(manager, commands, session, line.decode(errors="replace"), write):
+                break
+            if not session.transaction:
+                idle.set()
+            else:
+                idle.clear()
+        await writer.drain()
+    except ConnectionError:
+        pass
+    except Exception:
+        # A command that would have ended the shell only ends its own session
+        traceback.print_exc()
+    finally:
+        if session.transaction and manager.in_transaction:
+            runSession(manager, commands, session, "rollback", write)
+            idle.set()
+        writer.close()
+
+# Serves the namespace at address until interrupted: a path for a Unix socket or HOST:PORT for TCP
+async def serve(manager: Manager, commands: dict, address: str):
+    idle = asyncio.Event()
+    idle.set()
+    async def client(reader, writer):
+        await serveClient(manager, commands, reader, writer, idle)
+    host, _, port = address.rpartition(":")
+    # Lines can name many paths, so they're allowed to be far longer than asyncio's default
+    if port.isdigit() and "/" not in address:
+        server = await asyncio.start_server(client, host or "127.0.0.1", int(port), limit=1 << 24)
+    else:
+        server = await asyncio.start_unix_server(client, address, limit=1 << 24)
+    print(f"serving on {address}", file=sys.stderr)
+    async with server:
+        await server.serve_forever()
 
 if __name__ == '__main__':
     main()